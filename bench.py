@@ -0,0 +1,776 @@
+"""
+Benchmarks for Flourish.
+
+    python bench.py             # run them all
+    python bench.py elegant     # run just one
+    python bench.py pipeline --json before.json
+    python bench.py pipeline --compare before.json
+
+The pipeline benchmark times each stage of drawing a fixed, seeded corpus of
+curves, and can save its results as JSON to compare against later.
+"""
+
+import argparse
+import contextlib
+import copy
+import dataclasses
+import functools
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+import cairo
+import numpy as np
+
+from PIL import Image, ImageChops
+
+from cache import RenderCache
+from constants import FULLX, FULLY, THUMBX, THUMBY
+from curve import compute_dtype
+from fastsin import sin_grid
+from harmonograph import STYLES, Harmonograph
+from imageformat import WEBP_METHOD, WEBP_QUALITY, decode_pixels, encode_pixels
+from lod import Pyramid
+from parameter import Parameter, Parameterized, global_value
+from pngfile import encode_png, text_chunk
+from render import (
+    ColorLine,
+    ElegantLine,
+    Render,
+    draw_png,
+    lookup,
+    png_metadata,
+    polyline,
+)
+from simplify import simplify_points
+from svg import PRECISION, draw_svg, svg_document
+from tiled import BAND_HEIGHT, _draw_band, pixel_bands, split_bands
+from util import dict_to_slug, slug_to_dict
+
+SIZES = [
+    ("THUMB", (THUMBX, THUMBY)),
+    ("half-FULL", (FULLX // 2, FULLY // 2)),
+    ("FULL", (FULLX, FULLY)),
+]
+
+
+def timeit(fn, repeat=5):
+    """
+    Run `fn` `repeat` times, and return the best time in milliseconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def peak_memory(fn):
+    """
+    Run `fn`, and return the peak memory it allocated, in MB.
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def make_curves(n=5, seed=17):
+    rnd = random.Random(seed)
+    return [Harmonograph.make_random(rnd, npend=3, syms="RXYN") for _ in range(n)]
+
+
+def bench_elegant():
+    """
+    ElegantLine path construction: per-point loop vs. `polyline`.
+    """
+
+    def loop_path(ctx, xs, ys):
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            if i == 0:
+                ctx.move_to(x, y)
+            else:
+                ctx.line_to(x, y)
+
+    curves = make_curves()
+    print("ElegantLine path build (ms, best of 5, sum over curves)")
+    print(f"{'size':>10} {'points':>8} {'loop':>8} {'batch':>8} {'speedup':>8}")
+    for name, (width, height) in SIZES:
+        dt = lookup(width, ElegantLine.DTS)
+        maxsize = min(width, height)
+        # Both get lists, as the renders hand `polyline`.
+        ptss = [(c.points_array(["x", "y"], dt=dt) * maxsize).tolist() for c in curves]
+        with cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height) as surface:
+            ctx = cairo.Context(surface)
+
+            def run(build):
+                for pts in ptss:
+                    build(ctx, *pts)
+                    ctx.new_path()
+
+            before = timeit(lambda: run(loop_path))
+            after = timeit(lambda: run(polyline))
+        npoints = sum(len(xs) for xs, _ in ptss)
+        print(
+            f"{name:>10} {npoints:>8} {before:>8.1f} {after:>8.1f} "
+            f"{before / after:>7.1f}x"
+        )
+
+
+def bench_adaptive():
+    """
+    Point counts and sampling time: uniform vs. adaptive sampling.
+    """
+    curves = make_curves()
+    print("Points per curve (mean), and sampling time (ms, best of 5, all curves)")
+    print(
+        f"{'size':>10} {'uniform':>8} {'adaptive':>8} {'ratio':>6} "
+        f"{'t_unif':>8} {'t_adapt':>8}"
+    )
+    for name, (width, height) in SIZES:
+        dt = lookup(width, ElegantLine.DTS)
+        scale = min(width, height)
+        dims = ["x", "y"]
+        uniform = [c.points_array(dims, dt=dt).shape[1] for c in curves]
+        adaptive = [
+            c.adaptive_points_array(
+                dims, dt=dt, scale=scale, max_error=ElegantLine.MAX_ERROR
+            ).shape[1]
+            for c in curves
+        ]
+        t_unif = timeit(lambda: [c.points_array(dims, dt=dt) for c in curves])
+        t_adapt = timeit(
+            lambda: [
+                c.adaptive_points_array(dims, dt=dt, scale=scale) for c in curves
+            ]
+        )
+        nu = sum(uniform) / len(curves)
+        na = sum(adaptive) / len(curves)
+        print(
+            f"{name:>10} {nu:>8.0f} {na:>8.0f} {na / nu:>6.2f} "
+            f"{t_unif:>8.1f} {t_adapt:>8.1f}"
+        )
+
+
+def bench_batch():
+    """
+    Evaluating a grid page's worth of curves: one at a time vs. batched.
+    """
+    curves = make_curves(n=30)
+    dims = ["x", "y", "j", "k"]
+    print("Points for 30 curves (ms, best of 5)")
+    print(f"{'size':>10} {'points':>8} {'loop':>8} {'batch':>8} {'speedup':>8}")
+    for name, (width, height) in SIZES:
+        dt = lookup(width, ElegantLine.DTS)
+        npoints = curves[0].points_array(["x"], dt=dt).shape[1]
+        before = timeit(lambda: [c.points_array(dims, dt=dt) for c in curves])
+        after = timeit(lambda: Harmonograph.batch_points_array(curves, dims, dt=dt))
+        print(
+            f"{name:>10} {npoints:>8} {before:>8.1f} {after:>8.1f} "
+            f"{before / after:>7.1f}x"
+        )
+
+
+def bench_fastsin():
+    """
+    sin(w*t + p) on uniform grids: np.sin vs. the fastsin block tables.
+    """
+    w, p = 5.0031, 1.3
+    print("sin(w*t + p) (ms, best of 5), and max difference from np.sin")
+    print(f"{'points':>8} {'np.sin':>8} {'table':>8} {'speedup':>8} {'max err':>9}")
+    for npoints in [1000, 10000, 100000, 1000000]:
+        t = np.arange(start=1600, stop=1600 + npoints * 0.001, step=0.001)
+        err = np.abs(sin_grid(w, p, t) - np.sin(w * t + p)).max()
+        assert err < 1e-9, f"fastsin error too large: {err}"
+        before = timeit(lambda: np.sin(w * t + p))
+        after = timeit(lambda: sin_grid(w, p, t))
+        print(
+            f"{npoints:>8} {before:>8.2f} {after:>8.2f} {before / after:>7.1f}x "
+            f"{err:>9.1e}"
+        )
+
+
+def bench_dtype():
+    """
+    float64 vs. float32 compute: peak memory, and how much the output moves.
+    """
+    curves = make_curves()
+    dims = ["x", "y", "j", "k"]
+    print("Peak MB traced per render (Cairo's own memory isn't traced),")
+    print("and how far float32 moves points (px) and pixels (0-255), and the")
+    print("% of pixels it changes at all")
+    print(
+        f"{'size':>10} {'pts f64':>8} {'pts f32':>8} {'png f64':>8} {'png f32':>8} "
+        f"{'max px':>8} {'pix diff':>8} {'changed':>8}"
+    )
+    for name, (width, height) in SIZES:
+        dt = lookup(width, ElegantLine.DTS)
+        scale = min(width, height)
+        mem = {}
+        err = 0.0
+        pixdiff = 0
+        changed = []
+        for curve in curves:
+            out = {}
+            for dtype in [np.float64, np.float32]:
+                with global_value(compute_dtype, dtype):
+                    out[dtype] = curve.points_array(dims, dt=dt)
+                    mem.setdefault(("pts", dtype), []).append(
+                        peak_memory(lambda: curve.points_array(dims, dt=dt))
+                    )
+                    mem.setdefault(("png", dtype), []).append(
+                        peak_memory(lambda: draw_png(curve, (width, height)))
+                    )
+                    out["png", dtype] = Image.open(draw_png(curve, (width, height)))
+            xy_err = np.abs(out[np.float64][:2] - out[np.float32][:2]).max()
+            err = max(err, xy_err * scale)
+            diff = ImageChops.difference(
+                out["png", np.float64].convert("RGB"),
+                out["png", np.float32].convert("RGB"),
+            )
+            pixdiff = max(pixdiff, max(hi for _, hi in diff.getextrema()))
+            changed.append(np.asarray(diff).any(axis=2).mean())
+        print(
+            f"{name:>10} "
+            f"{max(mem['pts', np.float64]):>8.1f} {max(mem['pts', np.float32]):>8.1f} "
+            f"{max(mem['png', np.float64]):>8.1f} {max(mem['png', np.float32]):>8.1f} "
+            f"{err:>8.3f} {pixdiff:>8} {100 * np.mean(changed):>7.3f}%"
+        )
+
+
+def bench_formats():
+    """
+    Thumbnail encodings: bytes and encode time, from the same pixels.
+    """
+    curves = make_curves(n=10)
+    size = (THUMBX * 2, THUMBY * 2)
+
+    def cairo_png(pixels):
+        height, width, _ = pixels.shape
+        bgrx = np.zeros((height, width, 4), dtype=np.uint8)
+        bgrx[:, :, 2::-1] = pixels
+        surface = cairo.ImageSurface.create_for_data(
+            bgrx, cairo.FORMAT_RGB24, width, height
+        )
+        pngio = BytesIO()
+        surface.write_to_png(pngio)
+        return pngio.getvalue()
+
+    def our_png(pixels, level):
+        height, width, channels = pixels.shape
+        return b"".join(
+            encode_png(width, height, [pixels], level=level, channels=channels)
+        )
+
+    def webp(pixels):
+        if pixels.shape[2] == 1:
+            pixels = pixels[:, :, 0]
+        webpio = BytesIO()
+        Image.fromarray(pixels).save(
+            webpio, format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD
+        )
+        return webpio.getvalue()
+
+    encoders = [
+        ("cairo png", cairo_png),
+        ("png 1", lambda pixels: our_png(pixels, 1)),
+        ("png 9", lambda pixels: our_png(pixels, 9)),
+        ("webp", webp),
+    ]
+    print(f"Thumbnails at {size[0]}x{size[1]}, {len(curves)} curves")
+    print("(mean KB, mean encode ms, best of 5)")
+    print(f"{'style':>12} {'encoding':>10} {'KB':>8} {'ms':>8}")
+    for render in [ElegantLine(), ColorLine()]:
+        rgb = [
+            np.concatenate(list(pixel_bands(curve, size, render))) for curve in curves
+        ]
+        if render.monochrome:
+            # Time every encoding from RGB, and ours from one channel too.
+            gray = rgb
+            rgb = [np.repeat(pixels, 3, axis=2) for pixels in gray]
+        rows = [(name, enc, rgb) for name, enc in encoders]
+        if render.monochrome:
+            rows[3:3] = [
+                ("gray png 1", lambda pixels: our_png(pixels, 1), gray),
+                ("gray png 9", lambda pixels: our_png(pixels, 9), gray),
+            ]
+            # Gray PNG is lossless.
+            png = our_png(gray[0], 9)
+            assert (np.asarray(Image.open(BytesIO(png))) == gray[0][:, :, 0]).all()
+        for name, enc, images in rows:
+            kb = np.mean([len(enc(pixels)) for pixels in images]) / 1024
+            ms = np.mean([timeit(lambda: enc(pixels)) for pixels in images])
+            print(f"{type(render).__name__:>12} {name:>10} {kb:>8.1f} {ms:>8.2f}")
+
+
+def bench_svg():
+    """
+    The /one SVG: Cairo's SVGSurface vs. our own writer.
+    """
+
+    def cairo_svg(curve, size, render):
+        svgio = BytesIO()
+        with cairo.SVGSurface(svgio, *size) as surface:
+            surface.set_document_unit(cairo.SVGUnit.PX)
+            render.draw(surface, size, curve)
+        return svgio.getvalue().decode("ascii")
+
+    curves = make_curves()
+    size = (FULLX // 2, FULLY // 2)
+    print(f"SVG at {size[0]}x{size[1]}, {len(curves)} curves")
+    print("(mean KB, mean ms, best of 3)")
+    print(
+        f"{'style':>12} {'cairo KB':>9} {'ours KB':>8} {'cairo ms':>9} {'ours ms':>8}"
+    )
+    for render in [ElegantLine(), ColorLine()]:
+        row = []
+        for fn in [cairo_svg, draw_svg]:
+            row.append(np.mean([len(fn(c, size, render)) for c in curves]) / 1024)
+            row.append(
+                np.mean([timeit(lambda: fn(c, size, render), repeat=3) for c in curves])
+            )
+        print(
+            f"{type(render).__name__:>12} {row[0]:>9.1f} {row[2]:>8.1f} "
+            f"{row[1]:>9.1f} {row[3]:>8.1f}"
+        )
+
+
+def bench_simplify():
+    """
+    Polyline simplification: points dropped, time taken, and pixels moved.
+    """
+    curves = make_curves()
+    print(f"Simplifying to {Render.TOLERANCE}px, totals over {len(curves)} curves")
+    print("(ms are best of 3)")
+    print(
+        f"{'size':>10} {'points':>8} {'kept':>8} {'ratio':>6} {'simp ms':>8} "
+        f"{'draw ms':>8} {'+simp ms':>8} {'pix diff':>8}"
+    )
+    plain, simple = ElegantLine(linewidth=3), ElegantLine(linewidth=3, simplify=True)
+    for name, size in SIZES:
+        points = kept = 0
+        simp_ms = draw_ms = both_ms = 0.0
+        pixdiff = 0
+        for curve in curves:
+            plain.prepare(size, curve)
+            pts = plain.sample(curve, ["x", "y"])
+            points += pts.shape[1]
+            kept += simplify_points(pts, Render.TOLERANCE).shape[1]
+            simp_ms += timeit(lambda: simplify_points(pts, Render.TOLERANCE), repeat=3)
+            draw_ms += timeit(lambda: draw_png(curve, size, render=plain), repeat=3)
+            both_ms += timeit(lambda: draw_png(curve, size, render=simple), repeat=3)
+            diff = ImageChops.difference(
+                Image.open(draw_png(curve, size, render=plain)).convert("RGB"),
+                Image.open(draw_png(curve, size, render=simple)).convert("RGB"),
+            )
+            pixdiff = max(pixdiff, max(hi for _, hi in diff.getextrema()))
+        print(
+            f"{name:>10} {points:>8} {kept:>8} {kept / points:>6.2f} {simp_ms:>8.1f} "
+            f"{draw_ms:>8.1f} {both_ms:>8.1f} {pixdiff:>8}"
+        )
+
+
+def bench_lod():
+    """
+    Levels of detail: every size drawn, vs. drawn once and downsampled.
+    """
+    curves = make_curves()
+    sizes = [(FULLX, FULLY), (THUMBX * 2, THUMBY * 2), (THUMBX, THUMBY)]
+
+    def draw(render, curve, size):
+        return np.concatenate(list(pixel_bands(curve, size, render)))
+
+    def drawn(render, curve):
+        return [draw(render, curve, size) for size in sizes]
+
+    def derived(render, curve):
+        def render_master():
+            pixels = draw(render, curve, sizes[0])
+            return b"".join(encode_pixels(pixels, level=1))
+
+        pyramid = Pyramid(RenderCache(), lambda size: size, sizes[0], render_master)
+        return [decode_pixels(pyramid.image(size, level=1)) for size in sizes]
+
+    render = STYLES[3]
+    print(f"{', '.join(f'{w}x{h}' for w, h in sizes)} of {len(curves)} curves")
+    print("(mean ms, best of 3, style 3)")
+    drawn_ms = np.mean([timeit(lambda: drawn(render, c), repeat=3) for c in curves])
+    derived_ms = np.mean([timeit(lambda: derived(render, c), repeat=3) for c in curves])
+    print(f"{'drawn ms':>12} {drawn_ms:>8.1f}")
+    print(f"{'derived ms':>12} {derived_ms:>8.1f}")
+
+    print("(derived vs. drawn pixels: mean and max abs difference, 0-255,")
+    print(" and % of pixels more than 16 off)")
+    print(f"{'style':>5} {'size':>8} {'mean':>6} {'max':>4} {'>16 %':>6}")
+    for style, render in enumerate(STYLES):
+        diffs = [
+            np.abs(a.astype(int) - b)
+            for c in curves
+            for a, b in list(zip(drawn(render, c), derived(render, c)))[1:]
+        ]
+        for i, (w, h) in enumerate(sizes[1:]):
+            size_diffs = diffs[i :: len(sizes) - 1]
+            mean = np.mean([d.mean() for d in size_diffs])
+            most = max(d.max() for d in size_diffs)
+            off = 100 * np.mean([(d > 16).mean() for d in size_diffs])
+            print(f"{style:>5} {f'{w}x{h}':>8} {mean:>6.2f} {most:>4} {off:>6.2f}")
+
+
+def bench_urls():
+    """
+    /one's thumbnail urls: walking dataclass fields vs. compiled schemas.
+    """
+
+    def walked_paramdefs(cls):
+        for field in dataclasses.fields(cls):
+            if isinstance(field.type, Parameter):
+                yield field
+
+    def walked_from_short_params(cls, name, params):
+        kwargs = {}
+        for field in walked_paramdefs(cls):
+            key = name + field.type.key
+            if key in params:
+                kwargs[field.name] = field.type.from_short(params[key])
+            else:
+                kwargs[field.name] = field.type.default
+        return cls(name=name, **kwargs)
+
+    def walked_short_parameters(self):
+        shorts = {}
+        for thing, _ in self.param_things():
+            for field in walked_paramdefs(type(thing)):
+                val = field.type.to_short(getattr(thing, field.name))
+                shorts[thing.name + field.type.key] = str(val)
+        return shorts
+
+    def walked_to_slug(d):
+        return "".join(itertools.chain.from_iterable((k, str(v)) for k, v in d.items()))
+
+    def walked_to_dict(s):
+        return dict(re.findall(r"([a-z]+)(-?\d+)", s))
+
+    @contextlib.contextmanager
+    def walking():
+        # From vars, to get the classmethod itself rather than a bound one.
+        names = ["from_short_params", "short_parameters"]
+        saved = [vars(Parameterized)[name] for name in names]
+        Parameterized.from_short_params = classmethod(walked_from_short_params)
+        Parameterized.short_parameters = walked_short_parameters
+        try:
+            yield
+        finally:
+            Parameterized.from_short_params, Parameterized.short_parameters = saved
+
+    def one_page(slug, to_slug, to_dict, to_html):
+        # What /one does for its adjacent thumbs: make each curve, and the
+        # html with its urls.
+        harm = Harmonograph.make_from_short_params(to_dict(slug))
+        shorts = harm.short_parameters()
+        thumbs = []
+        for field, thing, _, val in harm.parameters():
+            for adj in field.type.adjacent(val):
+                key = thing.name + field.type.key
+                adj_params = {**shorts, key: field.type.to_short(adj)}
+                adj_shorts = Harmonograph.make_from_short_params(
+                    adj_params
+                ).short_parameters()
+                png_params = {**adj_shorts, "sx": THUMBX * 2, "sy": THUMBY * 2}
+                thumbs.append(
+                    to_html(
+                        url="/one/" + to_slug(adj_shorts),
+                        pngurl="/png/" + to_slug(png_params),
+                        sx=THUMBX,
+                        sy=THUMBY,
+                        title=None,
+                        sprite=None,
+                    )
+                )
+        return thumbs
+
+    # Only this benchmark needs the web app.
+    import flask
+    import webapp
+
+    def compile_each_time(**context):
+        return flask.render_template_string(webapp.THUMB_HTML, **context)
+
+    slugs = [dict_to_slug(curve.short_parameters()) for curve in make_curves()]
+    before_args = (walked_to_slug, walked_to_dict, compile_each_time)
+    after_args = (dict_to_slug, slug_to_dict, webapp.thumb_template.render)
+    with walking(), webapp.app.app_context():
+        before_html = [one_page(s, *before_args) for s in slugs]
+        before = timeit(lambda: [one_page(s, *before_args) for s in slugs])
+    after_html = [one_page(s, *after_args) for s in slugs]
+    after = timeit(lambda: [one_page(s, *after_args) for s in slugs])
+    assert before_html == after_html
+    nthumbs = sum(len(thumbs) for thumbs in after_html)
+    print(f"Thumbnails for {len(slugs)} /one pages, {nthumbs} thumbs")
+    print("(ms, best of 5)")
+    print(f"{'before':>8} {'after':>8} {'speedup':>8}")
+    print(f"{before:>8.2f} {after:>8.2f} {before / after:>7.1f}x")
+
+
+PIPELINE_SIZES = [
+    ("THUMB", (THUMBX, THUMBY)),
+    ("2xTHUMB", (THUMBX * 2, THUMBY * 2)),
+    ("half-FULL", (FULLX // 2, FULLY // 2)),
+    ("FULL", (FULLX, FULLY)),
+]
+PIPELINE_FORMATS = ["png", "webp", "svg"]
+STAGES = ["parse", "points", "path", "rasterize", "encode", "metadata"]
+
+
+def make_corpus(n=12, seed=17):
+    """
+    Make `n` slugs of random curves, cycling through pendulum counts,
+    densities, and styles.
+    """
+    rnd = random.Random(seed)
+    densities = [0.5, 1.0, 2.0]
+    slugs = []
+    for i in range(n):
+        curve = Harmonograph.make_random(rnd, npend=2 + i % 3, syms="RXYN")
+        curve.density = densities[i // 3 % len(densities)]
+        curve.style = i % len(STYLES)
+        slugs.append(dict_to_slug(curve.short_parameters()))
+    return slugs
+
+
+@contextlib.contextmanager
+def stage(times, name):
+    """
+    Time the body of the with-statement as stage `name`, in ms.
+    """
+    start = time.perf_counter()
+    yield
+    times[name] = (time.perf_counter() - start) * 1000
+
+
+def run_pipeline(slug, size, fmt, level=6):
+    """
+    Draw the curve for `slug` at `size` in format `fmt`, as the web app does,
+    and return the milliseconds each stage took.
+    """
+    width, height = size
+    times = {}
+    with stage(times, "parse"):
+        curve = Harmonograph.make_from_short_params(slug_to_dict(slug))
+        render = copy.copy(curve.render)
+    with stage(times, "points"):
+        render.prepare(size, curve)
+        chunks = list(render.sample_chunks(curve, ["x", "y"] + render.extras))
+    if fmt == "svg":
+        unit = 10**PRECISION
+        with stage(times, "path"):
+            paths = render.svg_paths(chunks, unit)
+        with stage(times, "encode"):
+            svg_document(size, render.bg, unit, paths).encode("utf-8")
+        return times
+
+    # As tiled.pixel_bands does it, with the bands drawn here.
+    with stage(times, "path"):
+        runs = split_bands(chunks, height, BAND_HEIGHT, render)
+    with stage(times, "rasterize"):
+        render.surface = render.points = None
+        bands = []
+        for top, band in zip(range(0, height, BAND_HEIGHT), runs):
+            rows = min(BAND_HEIGHT, height - top)
+            bands.append(_draw_band((render, width, height, top, rows, band)))
+        pixels = np.concatenate(bands)
+    with stage(times, "encode"):
+        b"".join(encode_pixels(pixels, fmt, level))
+    if fmt == "png":
+        with stage(times, "metadata"):
+            b"".join(text_chunk(k, v) for k, v in png_metadata(curve).items())
+    return times
+
+
+def percentiles(samples):
+    return {
+        "p50": round(float(np.percentile(samples, 50)), 3),
+        "p95": round(float(np.percentile(samples, 95)), 3),
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def bench_pipeline(
+    repeat=5,
+    seed=17,
+    ncurves=12,
+    sizes=None,
+    formats=None,
+    json_path=None,
+    compare=None,
+):
+    """
+    Each stage of the pipeline, from slug to encoded image, on a corpus.
+
+    For each size and format, reports the p50 and p95 of each stage over
+    every curve and repeat, and the peak memory Python allocated for one
+    curve (Cairo's own memory isn't counted).
+    """
+    slugs = make_corpus(ncurves, seed)
+    sizes = [(name, wh) for name, wh in PIPELINE_SIZES if not sizes or name in sizes]
+    formats = formats or PIPELINE_FORMATS
+    cases = []
+    summary = []
+    for size_name, size in sizes:
+        for fmt in formats:
+            samples = {}
+            peaks = []
+            for slug in slugs:
+                run_pipeline(slug, size, fmt)  # Warm up.
+                runs = [run_pipeline(slug, size, fmt) for _ in range(repeat)]
+                peak = peak_memory(lambda: run_pipeline(slug, size, fmt))
+                peaks.append(peak)
+                case_stages = {}
+                for name in [s for s in STAGES if s in runs[0]] + ["total"]:
+                    if name == "total":
+                        values = [sum(r.values()) for r in runs]
+                    else:
+                        values = [r[name] for r in runs]
+                    samples.setdefault(name, []).extend(values)
+                    case_stages[name] = percentiles(values)
+                cases.append(
+                    {
+                        "slug": slug,
+                        "size": size_name,
+                        "format": fmt,
+                        "stages": case_stages,
+                        "peak_mb": round(peak, 3),
+                    }
+                )
+            summary.append(
+                {
+                    "size": size_name,
+                    "format": fmt,
+                    "stages": {name: percentiles(v) for name, v in samples.items()},
+                    "peak_mb": round(max(peaks), 3),
+                }
+            )
+
+    baseline = None
+    if compare is not None:
+        with open(compare) as f:
+            baseline = {
+                (row["size"], row["format"]): row for row in json.load(f)["summary"]
+            }
+
+    print(f"Pipeline stages for {len(slugs)} curves, {repeat} runs each")
+    if baseline is None:
+        print("(ms p50/p95, peak MB)")
+    else:
+        print(f"(ms p50, and its ratio to {compare})")
+    columns = STAGES + ["total"]
+    header = " ".join(f"{c:>13}" for c in columns)
+    print(f"{'size':>10} {'fmt':>4} {header} {'peak':>9}")
+    for row in summary:
+        cells = []
+        for name in columns:
+            stat = row["stages"].get(name)
+            if stat is None:
+                cells.append(f"{'-':>13}")
+            elif baseline is None:
+                cells.append(f"{stat['p50']:>6.1f}/{stat['p95']:<6.1f}")
+            else:
+                old = baseline.get((row["size"], row["format"]), {}).get("stages", {})
+                old_p50 = old.get(name, {}).get("p50")
+                ratio = f"{stat['p50'] / old_p50:.2f}x" if old_p50 else "new"
+                cells.append(f"{stat['p50']:>6.1f} {ratio:>6}")
+        print(f"{row['size']:>10} {row['format']:>4} " + " ".join(cells), end="")
+        print(f" {row['peak_mb']:>7.1f}MB")
+
+    if json_path is not None:
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "cairo": cairo.cairo_version_string(),
+                "seed": seed,
+                "repeat": repeat,
+                "curves": len(slugs),
+            },
+            "summary": summary,
+            "cases": cases,
+        }
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {json_path}")
+
+
+BENCHES = {
+    "elegant": bench_elegant,
+    "adaptive": bench_adaptive,
+    "batch": bench_batch,
+    "fastsin": bench_fastsin,
+    "dtype": bench_dtype,
+    "formats": bench_formats,
+    "svg": bench_svg,
+    "simplify": bench_simplify,
+    "lod": bench_lod,
+    "pipeline": bench_pipeline,
+    "urls": bench_urls,
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks for Flourish.")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, or all")
+    group = parser.add_argument_group("pipeline")
+    group.add_argument("--repeat", type=int, default=5, help="runs per case")
+    group.add_argument("--seed", type=int, default=17, help="corpus seed")
+    group.add_argument("--curves", type=int, default=12, help="corpus size")
+    group.add_argument(
+        "--sizes", nargs="+", choices=[name for name, _ in PIPELINE_SIZES]
+    )
+    group.add_argument("--formats", nargs="+", choices=PIPELINE_FORMATS)
+    group.add_argument("--json", metavar="PATH", help="write results to PATH")
+    group.add_argument("--compare", metavar="PATH", help="compare with results")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHES:
+            choices = ", ".join(BENCHES)
+            parser.error(f"no benchmark {name!r}: choose from {choices}")
+
+    benches = dict(BENCHES)
+    benches["pipeline"] = functools.partial(
+        bench_pipeline,
+        repeat=args.repeat,
+        seed=args.seed,
+        ncurves=args.curves,
+        sizes=args.sizes,
+        formats=args.formats,
+        json_path=args.json,
+        compare=args.compare,
+    )
+    for name in args.names or benches:
+        benches[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
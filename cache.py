@@ -0,0 +1,245 @@
+"""
+A cache for rendered images.
+
+Rendered output depends only on the curve's parameters and the output size,
+so it is stored under a key computed from the canonical parameter values.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+def cache_key(*parts):
+    """
+    Make a cache key from JSON-able `parts`.
+    """
+    canonical = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(canonical.encode("ascii")).hexdigest()
+
+
+def curve_key(curve, kind, size, **extra):
+    """
+    Make a cache key for rendering `curve` as `kind` at `size`.
+
+    The key is made from the parameter values, not the slug, so key order in
+    the slug and parameters given with their default values don't matter.
+    """
+    values = {
+        thing.name + field.type.key: val
+        for field, thing, _, val in curve.parameters()
+    }
+    return cache_key(type(curve).__name__, kind, list(size), values, extra)
+
+
+class RenderCache:
+    """
+    An LRU of rendered bytes, bounded by total size, with an optional
+    on-disk tier in `directory`, bounded by `max_disk_bytes`.
+
+    The disk tier is an LRU by file modification time: reads touch the
+    files they hit.  Other processes can share the directory, so it is
+    scanned for its real size every so often, and the least recently used
+    files are removed when it's over.
+    """
+
+    # Scans of the directory per `max_disk_bytes` written by this process.
+    DISK_SCANS = 16
+    # When pruning, the fraction of `max_disk_bytes` to get down to, so that
+    # every write doesn't prune again.
+    DISK_LOW_WATER = 0.9
+
+    def __init__(
+        self,
+        max_bytes=64 * 1024 * 1024,
+        directory=None,
+        max_disk_bytes=1024 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self.prune_lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Bytes written to disk since the last scan, and found by it.
+        self.disk_written = 0
+        self.disk_bytes = 0
+        self.disk_evictions = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._prune_disk()
+
+    def get(self, key):
+        """
+        Get the bytes for `key`, or None if they aren't cached.
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._disk_get(key)
+        if data is not None:
+            self._memory_put(key, data)
+            with self.lock:
+                self.disk_hits += 1
+        return data
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.entries:
+                return True
+        return self.directory is not None and os.path.exists(self._disk_path(key))
+
+    def put(self, key, data):
+        self._memory_put(key, data)
+        self._disk_put(key, data)
+
+    def get_or_render(self, key, render, flights=None):
+        """
+        Get the bytes for `key`, calling `render()` to make them if needed.
+
+        With `flights`, a SingleFlight, concurrent calls for the same key
+        share one render.
+        """
+        data = self.get(key)
+        if data is None:
+            if flights is None:
+                data = self._render(key, render)
+            else:
+                data = flights.do(
+                    key,
+                    lambda: self._render(key, render),
+                    check=lambda: self.get(key),
+                )
+        return data
+
+    def _render(self, key, render):
+        with self.lock:
+            self.misses += 1
+        data = render()
+        self.put(key, data)
+        return data
+
+    def tee(self, key, chunks):
+        """
+        Produce the bytes from `chunks`, and cache them all under `key` once
+        they have all been produced.
+
+        For rendering while responding: if the consumer stops early, nothing
+        is cached.
+        """
+        with self.lock:
+            self.misses += 1
+        pieces = []
+        for chunk in chunks:
+            pieces.append(chunk)
+            yield chunk
+        self.put(key, b"".join(pieces))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self.disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "disk_evictions": self.disk_evictions,
+            }
+
+    def _memory_put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self.entries[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _disk_get(self, key):
+        if self.directory is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Mark it used, for pruning.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _disk_put(self, key, data):
+        if self.directory is None:
+            return
+        # Write to a temp file and rename, so readers never see partial files.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._disk_path(key))
+        with self.lock:
+            self.disk_written += len(data)
+            scan = self.disk_written >= self.max_disk_bytes // self.DISK_SCANS
+            if scan:
+                self.disk_written = 0
+        if scan:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """
+        Remove the least recently used files while the directory holds more
+        than `max_disk_bytes`.
+        """
+        if not self.prune_lock.acquire(blocking=False):
+            # Another thread is on it.
+            return
+        try:
+            files = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    # Skip temp files and SingleFlight's lock files.
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            if total > self.max_disk_bytes:
+                files.sort()
+                for _, size, path in files:
+                    if total <= self.max_disk_bytes * self.DISK_LOW_WATER:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        # Another process pruned it.
+                        pass
+                    total -= size
+                    evicted += 1
+            with self.lock:
+                self.disk_bytes = total
+                self.disk_evictions += evicted
+        finally:
+            self.prune_lock.release()
@@ -1,12 +1,141 @@
+import math
 from dataclasses import dataclass
 
-from parameter import Parameterized
+import numpy as np
+
+from parameter import GlobalParameter, Parameterized
+
+# The dtype that curves compute their points in.  np.float32 uses half the
+# memory; at thumbnail sizes it moves points by hundredths of a pixel, which
+# changes antialiased edges slightly, as `bench.py dtype` shows.
+compute_dtype = GlobalParameter("compute_dtype", default=np.float64)
 
 
 @dataclass
 class Curve(Parameterized):
+    # Adaptive sampling starts with samples this far apart (before time_step
+    # adjusts it), and refines from there.
+    COARSE_DT = 0.16
+
+    def time_span(self):
+        """
+        The (start, stop) of the time the curve is drawn over.
+        """
+        raise NotImplementedError
+
+    def time_step(self, dt):
+        """
+        The time between samples, for a requested `dt`.
+        """
+        return dt
+
+    def evaluate(self, dims, t, grid=None):
+        """
+        Compute the values of `dims` at the times in the array `t`.
+
+        If `t` is a uniform grid, `grid` is (start, step, len(t)), which
+        curves can use to recognize times they've seen before.
+
+        Returns a (len(dims), len(t)) array of `compute_dtype`.
+        """
+        raise NotImplementedError
+
+    def points_array(self, dims, dt=0.01):
+        """
+        Compute the points of the curve as a (len(dims), N) array.
+
+        Row i holds the values for dims[i], one column per sample.
+        """
+        start, stop = self.time_span()
+        step = self.time_step(dt)
+        t = np.arange(start=start, stop=stop, step=step)
+        return self.evaluate(dims, t, grid=(start, step, len(t)))
+
+    def points_chunks(self, dims, dt=0.01, chunk_size=65536):
+        """
+        Produce the points of `points_array` in chunks of at most `chunk_size`.
+
+        Each chunk after the first starts with the last point of the one
+        before, so that segments drawn from chunk to chunk are continuous.
+        Only one chunk's times and points exist at once.
+        """
+        start, stop = self.time_span()
+        step = self.time_step(dt)
+        # Make the same times as np.arange would: it steps by the difference
+        # of its first two values.
+        npoints = max(0, math.ceil((stop - start) / step))
+        delta = (start + step) - start
+        lo = 0
+        while lo < npoints:
+            hi = min(lo + chunk_size, npoints)
+            t = start + np.arange(lo, hi) * delta
+            yield self.evaluate(dims, t, grid=(float(t[0]), step, len(t)))
+            if hi == npoints:
+                break
+            lo = hi - 1
+
+    def adaptive_points_array(self, dims, dt, scale, max_error=0.5):
+        """
+        Like `points_array`, but with fewer points where the curve is straight.
+
+        The samples are a subset of the ones `points_array` would make.  The
+        curve starts sampled every `COARSE_DT`, then each interval is split
+        while its midpoint is more than `max_error` pixels from its chord, with
+        `scale` pixels per unit.  Only the first two dims are used to measure
+        the error.
+        """
+        start, stop = self.time_span()
+        step = self.time_step(dt)
+        npoints = len(np.arange(start=start, stop=stop, step=step))
+        if npoints == 0:
+            return np.empty((len(dims), 0), dtype=compute_dtype.get())
+        coarsen = max(1, round(self.COARSE_DT / dt))
+        idx = np.arange(0, npoints, coarsen)
+        if idx[-1] != npoints - 1:
+            idx = np.append(idx, npoints - 1)
+        pts = self.evaluate(dims, start + idx * step)
+
+        while True:
+            # Intervals that could be split, and their midpoints.
+            splittable = np.flatnonzero(np.diff(idx) > 1)
+            if len(splittable) == 0:
+                break
+            lo, hi = idx[splittable], idx[splittable + 1]
+            mid = (lo + hi) // 2
+            mid_pts = self.evaluate(dims, start + mid * step)
+
+            # How far is each midpoint from where the chord would put it?
+            frac = (mid - lo) / (hi - lo)
+            p0, p1 = pts[:2, splittable], pts[:2, splittable + 1]
+            off = mid_pts[:2] - (p0 + frac * (p1 - p0))
+            error = np.hypot(off[0], off[1]) * scale
+
+            split = error > max_error
+            if not split.any():
+                break
+            where = splittable[split] + 1
+            idx = np.insert(idx, where, mid[split])
+            pts = np.insert(pts, where, mid_pts[:, split], axis=1)
+
+        return pts
+
     def points(self, dims, dt=0.01):
-        pass
+        """
+        Produce the points one tuple at a time.
+
+        Prefer `points_array`, this is for callers that want to iterate.
+        """
+        yield from zip(*self.points_array(dims, dt=dt).tolist())
+
+    def bounds(self, dims, dt=0.01):
+        """
+        Get a (len(dims), 2) array of the low and high values in each dim.
+
+        Subclasses should compute this analytically.  This default samples
+        the curve.
+        """
+        pts = self.points_array(dims, dt=dt)
+        return np.stack([pts.min(axis=1), pts.max(axis=1)], axis=1)
 
     def draw_more(self, ctx):
         pass
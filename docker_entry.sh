@@ -1,3 +1,5 @@
 #!/bin/bash
 source venv/bin/activate
-exec gunicorn -b :5000 --access-logfile - --error-logfile - webapp:app
+# Threads wait on the render processes, so one worker serves many requests.
+exec gunicorn -b :5000 --worker-class gthread --threads "${GUNICORN_THREADS:-8}" \
+    --access-logfile - --error-logfile - webapp:app
@@ -0,0 +1,312 @@
+"""
+Rendering off the request threads, on a pool of processes.
+
+Renders are queued in lanes.  When a process is free, it takes the next
+render from the highest-priority lane that has one, so thumbnails for a page
+being looked at go ahead of big downloads, which go ahead of prerendering.
+Each lane's queue is bounded: when it's full, new renders are refused with
+`Busy` instead of waiting behind work that won't finish in time.  Renders
+can have a deadline: one that hasn't started by then is dropped.
+"""
+
+import collections
+import concurrent.futures
+import functools
+import math
+import multiprocessing
+import threading
+import time
+
+from harmonograph import Harmonograph, wave_cache
+from imageformat import image_stream
+from parameter import global_value
+from render import Render, draw_sprite_png, lookup
+from simplify import simplify_stats
+from svg import draw_svg
+from util import slug_to_dict
+from wavecache import WaveCache
+
+
+class Busy(Exception):
+    """
+    A lane's queue is full.  `retry_after` is a guess at when to try again,
+    in seconds.
+    """
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"Render lane {lane!r} is full")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Busy):
+    """
+    A render didn't finish by its deadline.
+    """
+
+    def __init__(self, lane, retry_after):
+        Exception.__init__(self, f"Render in lane {lane!r} missed its deadline")
+        self.retry_after = retry_after
+
+
+class Lane:
+    """
+    A queue of renders with a priority (lower goes first), a bound on how
+    many can wait, and a default time limit in seconds.
+    """
+
+    def __init__(self, name, priority, max_queue, timeout):
+        self.name = name
+        self.priority = priority
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.queue = collections.deque()
+        # A moving average of how long renders in this lane take.
+        self.seconds = 0.1
+        self.submitted = 0
+        self.completed = 0
+        self.refused = 0
+        self.expired = 0
+
+    def stats(self):
+        return {
+            "queued": len(self.queue),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "refused": self.refused,
+            "expired": self.expired,
+            "seconds": round(self.seconds, 4),
+        }
+
+
+def default_lanes():
+    return [
+        # What a page is waiting on: the /one SVG, and sprite sheets.
+        Lane("page", priority=0, max_queue=32, timeout=10),
+        Lane("thumb", priority=1, max_queue=128, timeout=10),
+        # Full-size downloads.
+        Lane("download", priority=2, max_queue=64, timeout=60),
+        # Every thumbnail of a /one page, more than a hundred of them.
+        Lane("prerender", priority=3, max_queue=1024, timeout=30),
+    ]
+
+
+class RenderExecutor:
+    """
+    Run renders on `workers` processes, from prioritized `lanes`.
+    """
+
+    def __init__(self, workers=2, lanes=None):
+        self.workers = workers
+        self.lanes = {lane.name: lane for lane in (lanes or default_lanes())}
+        self.by_priority = sorted(self.lanes.values(), key=lambda l: l.priority)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.running = 0
+
+    def submit(self, lane, fn, *args, deadline=None):
+        """
+        Queue `fn(*args)` in `lane`, and return a Future for its result.
+
+        `deadline` is a `time.monotonic()` time: if the render hasn't started
+        by then, the future gets DeadlineExceeded.  Raises Busy if the lane is
+        full.
+        """
+        return self._submit_many(lane, fn, [args], deadline)[0]
+
+    def run(self, lane, fn, *args, timeout=None):
+        """
+        Run `fn(*args)` in `lane`, and wait for its result.
+
+        Raises Busy if the lane is full, or DeadlineExceeded if the result
+        isn't ready within `timeout` seconds (the lane's timeout by default).
+        """
+        if timeout is None:
+            timeout = self.lanes[lane].timeout
+        future = self.submit(lane, fn, *args, deadline=time.monotonic() + timeout)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise DeadlineExceeded(lane, self.retry_after(lane)) from None
+
+    def map(self, fn, iterable, lane="download", timeout=None):
+        """
+        Like `Executor.map`: all of the calls are queued now, and the results
+        are produced in order.
+        """
+        if timeout is None:
+            timeout = self.lanes[lane].timeout
+        deadline = time.monotonic() + timeout
+        futures = self._submit_many(lane, fn, [(arg,) for arg in iterable], deadline)
+
+        def results():
+            try:
+                for future in futures:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        yield future.result(timeout=max(remaining, 0))
+                    except concurrent.futures.TimeoutError:
+                        raise DeadlineExceeded(lane, self.retry_after(lane)) from None
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return results()
+
+    def retry_after(self, lane):
+        """
+        Guess how many seconds until `lane` has room.
+        """
+        lane = self.lanes[lane]
+        waiting = sum(len(l.queue) for l in self.by_priority[: lane.priority + 1])
+        return max(1, math.ceil(waiting * lane.seconds / max(self.workers, 1)))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+            }
+
+    def _submit_many(self, lane_name, fn, arglists, deadline):
+        lane = self.lanes[lane_name]
+        with self.lock:
+            if len(lane.queue) + len(arglists) > lane.max_queue:
+                # Make room from renders that were cancelled while queued.
+                lane.queue = collections.deque(
+                    item for item in lane.queue if not item[0].cancelled()
+                )
+            if len(lane.queue) + len(arglists) > lane.max_queue:
+                lane.refused += 1
+                raise Busy(lane_name, self.retry_after(lane_name))
+            futures = []
+            for args in arglists:
+                future = concurrent.futures.Future()
+                lane.queue.append((future, fn, args, deadline))
+                futures.append(future)
+            lane.submitted += len(arglists)
+        self._dispatch()
+        return futures
+
+    def _dispatch(self):
+        """
+        Start queued renders, highest priority first, while there are free
+        processes.
+
+        Futures are only resolved with the lock released, since their
+        callbacks may take other locks.
+        """
+        starting, expired = [], []
+        with self.lock:
+            while self.running < self.workers:
+                lane = next((l for l in self.by_priority if l.queue), None)
+                if lane is None:
+                    break
+                future, fn, args, deadline = lane.queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if deadline is not None and time.monotonic() > deadline:
+                    lane.expired += 1
+                    expired.append((future, lane.name))
+                    continue
+                self.running += 1
+                starting.append((future, lane, fn, args))
+            if starting and self.pool is None:
+                # The pool is made on first use, so that each gunicorn worker
+                # gets its own, after gunicorn has forked.
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+        for future, lane_name in expired:
+            future.set_exception(
+                DeadlineExceeded(lane_name, self.retry_after(lane_name))
+            )
+        for future, lane, fn, args in starting:
+            started = time.monotonic()
+            try:
+                pool_future = self.pool.submit(_in_worker, fn, *args)
+            except Exception as exc:
+                # A worker died, and took the pool with it.
+                with self.lock:
+                    self.running -= 1
+                    self.pool = None
+                future.set_exception(exc)
+                continue
+            pool_future.add_done_callback(
+                functools.partial(self._done, future, lane, started)
+            )
+
+    def _done(self, future, lane, started, pool_future):
+        with self.lock:
+            self.running -= 1
+            lane.completed += 1
+            lane.seconds = 0.8 * lane.seconds + 0.2 * (time.monotonic() - started)
+        if pool_future.exception() is not None:
+            future.set_exception(pool_future.exception())
+        else:
+            result, simplified = pool_future.result()
+            simplify_stats.merge(simplified)
+            future.set_result(result)
+        self._dispatch()
+
+
+## What runs in the worker processes.
+
+# Each worker process has its own: the thumbnails for one page share most of
+# their waves.
+worker_waves = WaveCache()
+
+
+def _in_worker(fn, *args):
+    """
+    Return `fn(*args)`, with the simplify counts of this process since the
+    last render, for the executor to add to its own.
+    """
+    result = fn(*args)
+    return result, simplify_stats.take()
+
+
+def render_image(params, size, fmt="png", level=6, with_metadata=False):
+    """
+    Render the Harmonograph described by short `params` to image bytes in
+    format `fmt`, with PNG compression `level`, and its parameters in the
+    PNG if `with_metadata`.
+
+    The image is drawn a band at a time, so a full-size download never has
+    all of its pixels in memory at once.
+    """
+    harm = Harmonograph.make_from_short_params(params)
+    with global_value(wave_cache, worker_waves):
+        chunks = image_stream(
+            harm, size, fmt=fmt, level=level, with_metadata=with_metadata
+        )
+        return b"".join(chunks)
+
+
+def render_svg(params, size):
+    """
+    Render the Harmonograph described by short `params` to an SVG string.
+    """
+    harm = Harmonograph.make_from_short_params(params)
+    with global_value(wave_cache, worker_waves):
+        return draw_svg(curve=harm, size=size)
+
+
+def render_sprite(slugs, columns):
+    """
+    Render a sprite sheet of the thumbnails with /png `slugs` to PNG bytes.
+    """
+    curves = []
+    for slug in slugs:
+        params = slug_to_dict(slug)
+        curves.append(Harmonograph.make_from_short_params(params))
+        tile_size = int(params["sx"]), int(params["sy"])
+    # Evaluate all the curves together if they share a time grid.
+    dt = lookup(tile_size[0], Render.DTS)
+    try:
+        points = Harmonograph.batch_points_array(curves, ["x", "y", "j", "k"], dt)
+    except ValueError:
+        points = None
+    return draw_sprite_png(curves, tile_size, columns, points=points).getvalue()
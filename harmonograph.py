@@ -3,7 +3,8 @@ from dataclasses import dataclass
 
 import numpy as np
 
-from curve import Curve
+from curve import Curve, compute_dtype
+from fastsin import sin_wt, use_table
 from render import ColorLine, ElegantLine
 from parameter import GlobalParameter, Parameter, Parameterized, global_value
 from util import abc
@@ -11,6 +12,9 @@ from util import abc
 
 freq = GlobalParameter("freq")
 
+# A WaveCache to evaluate waves through, or None to evaluate them directly.
+wave_cache = GlobalParameter("wave_cache", default=None)
+
 
 @dataclass
 class FullWave(Parameterized):
@@ -47,8 +51,25 @@ class FullWave(Parameterized):
         random=lambda rnd: rnd.uniform(0, 2 * math.pi),
     )
 
-    def __call__(self, t, density=1):
-        return self.amp * np.sin((self.freq * density + self.tweq) * t + self.phase)
+    def __call__(self, t, density=1, grid=None):
+        return self.amp * sin_wt(self.freq * density + self.tweq, self.phase, t, grid)
+
+    def add_to(self, val, t, density, scratch, t0=0.0):
+        """
+        Add the wave at times `t0 + t` into `val`, computing in `scratch`.
+
+        Nothing is allocated.  `t0` is folded into the phase in float64, so
+        `t` can be offsets small enough to keep their precision in float32.
+        """
+        w = self.freq * density + self.tweq
+        phase = self.phase
+        if t0:
+            phase = (w * t0 + phase) % (2 * math.pi)
+        np.multiply(t, w, out=scratch)
+        scratch += phase
+        np.sin(scratch, out=scratch)
+        scratch *= self.amp
+        val += scratch
 
     @classmethod
     def make_random(cls, name, rnd, limit=None):
@@ -70,8 +91,8 @@ class Ramp(Parameterized):
         default=500,
     )
 
-    def __call__(self, t):
-        return t / self.stop
+    def __call__(self, t, out=None):
+        return np.divide(t, self.stop, out=out)
 
 
 @dataclass
@@ -90,11 +111,14 @@ class TimeSpan(Parameterized):
     )
 
 
+# Simplifying is off: for this thin opaque line it moves many pixels, as
+# `bench.py simplify` shows.  Levels of detail are only for the wide faint
+# lines, which `bench.py lod` shows derive closely; the others don't.
 STYLES = [
     ElegantLine(linewidth=3, alpha=1),
-    ColorLine(lightness=0, linewidth=50, alpha=0.1),
+    ColorLine(lightness=0, linewidth=50, alpha=0.1, lod=True),
     ColorLine(linewidth=10, alpha=0.5),
-    ColorLine(linewidth=50, alpha=0.1),
+    ColorLine(linewidth=50, alpha=0.1, lod=True),
 ]
 
 
@@ -134,42 +158,130 @@ class Harmonograph(Curve):
     def set_time_span(self, timespan):
         self.timespan = timespan
 
-    def points(self, dims, dt=0.01):
+    def time_span(self):
         ts_half = self.timespan.width // 2
-        t = np.arange(
-            start=self.timespan.center - ts_half,
-            stop=self.timespan.center + ts_half,
-            step=dt / self.density,
-        )
-        scale = len(self.dimensions["x"]) + 1
-        pts = []
-        for dim_name in dims:
-            waves = self.dimensions[dim_name]
-            val = 0.0
-            for wave in waves:
-                val += wave(t, self.density)
-            val *= self.ramp(t)
-            val /= scale
-            
-            pts.append(val)
-
-        normalized = False
-        if normalized:
-            stacked_vals = np.vstack(pts)
+        return self.timespan.center - ts_half, self.timespan.center + ts_half
 
-            min_val = np.min(stacked_vals)
-            max_val = np.max(stacked_vals)
+    def time_step(self, dt):
+        return dt / self.density
 
-            desired_min = -0.5
-            desired_max = 0.5
+    def evaluate(self, dims, t, grid=None):
+        dtype = np.dtype(compute_dtype.get())
+        cache = wave_cache.get() if grid is not None else None
+        table = dtype == np.float64 and use_table(t, grid)
+        scale = len(self.dimensions["x"]) + 1
 
-            normalized_pts = desired_min + (desired_max - desired_min) * (stacked_vals - min_val) / (max_val - min_val)
-            final_pts = normalized_pts
+        if dtype == np.float64 or len(t) == 0:
+            t0, tt = 0.0, t
         else:
-            final_pts = pts
+            # Narrow types can't hold large times precisely, so work with
+            # offsets from the middle time, and fold that into the phases.
+            # Centering keeps the largest offset to half the span.
+            t0 = float(t[len(t) // 2])
+            tt = (t - t0).astype(dtype)
+
+        pts = np.empty((len(dims), len(t)), dtype=dtype)
+        scratch = np.empty(len(t), dtype=dtype)
+        ramp = np.empty(len(t), dtype=dtype)
+        np.add(tt, t0, out=ramp)
+        self.ramp(ramp, out=ramp)
+        for val, dim_name in zip(pts, dims):
+            waves = self.dimensions[dim_name]
+            if cache is not None:
+                val[:] = cache.dim_sum(waves, self.density, grid, t)
+            else:
+                val[:] = 0.0
+                for wave in waves:
+                    if table:
+                        val += wave(t, self.density, grid)
+                    else:
+                        wave.add_to(val, tt, self.density, scratch, t0)
+            val *= ramp
+            val /= scale
+        return pts
 
-        for pt in zip(*final_pts):
-            yield pt
+    @classmethod
+    def batch_points_array(cls, harms, dims, dt=0.01, max_bytes=1024 * 1024):
+        """
+        Compute the points of many Harmonographs at once.
+
+        The curves must all have the same time grid (time span and density).
+        Their waves are packed into arrays and evaluated together, a chunk of
+        time at a time.  Since the grid is uniform, each chunk is the first
+        chunk shifted in time, so by angle addition:
+
+            sin(w*(t0 + tau) + p) = sin(w*tau)*cos(w*t0 + p)
+                                    + cos(w*tau)*sin(w*t0 + p)
+
+        sin(w*tau) and cos(w*tau) are computed once, and each chunk only
+        needs trig on the (curves, waves) values at its start.  The tables
+        are kept under `max_bytes`.
+
+        Returns a (len(harms), len(dims), N) array.
+        """
+        grids = {(harm.time_span(), harm.time_step(dt)) for harm in harms}
+        if len(grids) != 1:
+            raise ValueError("Harmonographs must share a time grid to batch")
+        ((start, stop), step), = grids
+        density = harms[0].density
+        t = np.arange(start=start, stop=stop, step=step)
+        nharms, npts = len(harms), len(t)
+
+        pts = np.empty((nharms, len(dims), npts))
+        for d, dim_name in enumerate(dims):
+            # Pack the waves into (nharms, nwaves) arrays, padded with waves
+            # of zero amplitude.
+            nwaves = max(len(harm.dimensions[dim_name]) for harm in harms)
+            w = np.zeros((nharms, nwaves))
+            amp = np.zeros((nharms, nwaves))
+            phase = np.zeros((nharms, nwaves))
+            for h, harm in enumerate(harms):
+                for i, wave in enumerate(harm.dimensions[dim_name]):
+                    w[h, i] = wave.freq * density + wave.tweq
+                    amp[h, i] = wave.amp
+                    phase[h, i] = wave.phase
+
+            chunk = max(1, min(npts, max_bytes // (16 * nharms * nwaves)))
+            # np.arange steps by t[1] - t[0], which isn't quite `step`.
+            wtau = w[:, :, None] * (np.arange(chunk) * (t[1] - t[0]))
+            sin_tau, cos_tau = np.sin(wtau), np.cos(wtau)
+            for lo in range(0, npts, chunk):
+                n = min(chunk, npts - lo)
+                start_angle = w * t[lo] + phase
+                out = pts[:, d, lo : lo + n]
+                np.einsum(
+                    "hwn,hw->hn",
+                    sin_tau[:, :, :n],
+                    amp * np.cos(start_angle),
+                    out=out,
+                )
+                out += np.einsum(
+                    "hwn,hw->hn", cos_tau[:, :, :n], amp * np.sin(start_angle)
+                )
+
+        ramp_stop = np.array([harm.ramp.stop for harm in harms], dtype=float)
+        scale = np.array([len(harm.dimensions["x"]) + 1 for harm in harms])
+        pts *= (t / ramp_stop[:, None])[:, None, :]
+        pts /= scale[:, None, None]
+        return pts
+
+    def bounds(self, dims, dt=0.01):
+        """
+        A conservative bound, computed from the parameters without sampling.
+
+        Each wave is within its amplitude, and the ramp is linear in t, so is
+        largest in magnitude at one end of the time span.
+        """
+        ramp_max = max(abs(self.ramp(t)) for t in self.time_span())
+        scale = len(self.dimensions["x"]) + 1
+        reach = np.array(
+            [
+                sum(abs(wave.amp) for wave in self.dimensions[dim_name])
+                for dim_name in dims
+            ]
+        )
+        reach *= ramp_max / scale
+        return np.stack([-reach, reach], axis=1)
 
     def param_things(self):
         for dim_name, dim in self.dimensions.items():
@@ -230,7 +342,6 @@ class Harmonograph(Curve):
         harm.add_dimension("j", [FullWave.make_random("j", rnd)], extra=True)
         harm.add_dimension("k", [FullWave.make_random("k", rnd)], extra=True)
         harm.set_ramp(Ramp("r", rampstop))
-        print("Setting timespan")
         harm.set_time_span(TimeSpan("ts", 1800, 400))
 
         return harm
@@ -0,0 +1,95 @@
+"""
+Choosing and encoding the image format for rendered curves.
+
+PNG is always available.  WebP is much smaller for our anti-aliased line
+art, so it's served to browsers that say they take it.
+"""
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, features
+
+from pngfile import encode_png
+from tiled import pixel_bands, png_stream
+
+MIMETYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+# Lossy WebP at this quality keeps thin lines crisp at 2x.  Method is
+# Pillow's speed/size trade-off, 0 (fast) to 6 (small).
+WEBP_QUALITY = 80
+WEBP_METHOD = 4
+
+
+def negotiate(accept):
+    """
+    Choose the image format for a request's `accept` (a werkzeug MIMEAccept).
+
+    Only an explicit image/webp counts: browsers that can't decode WebP
+    still send image/* or */*.
+    """
+    if features.check("webp"):
+        if any(value == "image/webp" and q > 0 for value, q in accept):
+            return "webp"
+    return "png"
+
+
+def image_stream(
+    curve, size, fmt="png", level=6, render=None, executor=None, with_metadata=False
+):
+    """
+    Start drawing `curve` in format `fmt`, and return an iterator of its bytes.
+
+    `level` is the PNG compression level.  `render`, `executor` and
+    `with_metadata` are as for `tiled.png_stream`; WebPs have no metadata.
+    """
+    if render is None:
+        render = curve.render
+    if fmt == "png":
+        return png_stream(
+            curve,
+            size,
+            render=render,
+            executor=executor,
+            level=level,
+            with_metadata=with_metadata,
+        )
+    assert fmt == "webp"
+    # WebP can't be encoded a band at a time, so the bands are put together.
+    bands = pixel_bands(curve, size, render, executor=executor)
+    return encode_pixels(np.concatenate(list(bands)), fmt)
+
+
+def encode_pixels(pixels, fmt="png", level=6, text=None):
+    """
+    Encode a (rows, width, channels) uint8 array of gray or RGB pixels in
+    format `fmt`, and return an iterator of the bytes.
+
+    `level` and `text` are for PNG, as for `pngfile.encode_png`.
+    """
+    height, width, channels = pixels.shape
+    if fmt == "png":
+        return encode_png(
+            width, height, [pixels], level=level, text=text, channels=channels
+        )
+    assert fmt == "webp"
+    if channels == 1:
+        pixels = pixels[:, :, 0]
+    webpio = BytesIO()
+    Image.fromarray(pixels).save(
+        webpio, format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD
+    )
+    return iter([webpio.getvalue()])
+
+
+def decode_pixels(data):
+    """
+    Decode image bytes to pixels as `encode_pixels` takes them.
+    """
+    pixels = np.asarray(Image.open(BytesIO(data)))
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, np.newaxis]
+    return pixels
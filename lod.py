@@ -0,0 +1,125 @@
+"""
+Levels of detail: smaller images of a curve downsampled from a larger one.
+
+A curve is drawn once at a master size.  Below it are levels at half the
+size, a quarter, and so on, each downsampled from the one above it.  An image
+at some other size is downsampled from the smallest level at least as big,
+so no downsampling is by more than half, which keeps Lanczos filtering
+sharp.  The master and the levels are cached, so once a curve's master has
+been drawn, every other size costs a few cheap resamples.  The resamples,
+like the drawing, can be done on another process.
+
+A master is far more expensive than a thumbnail, so it isn't worth drawing
+one just to derive a thumbnail from it: `cached_level` finds a level only
+if it's already there.
+"""
+
+import numpy as np
+from PIL import Image
+
+from imageformat import decode_pixels, encode_pixels
+
+# The master and the levels are cached as PNGs at this compression level:
+# they're read back more often than written.
+LEVEL_PNG_LEVEL = 1
+
+
+def downsample(pixels, size):
+    """
+    Resize (rows, width, channels) `pixels` to `size` with Lanczos filtering.
+    """
+    if pixels.shape[1::-1] == tuple(size):
+        return pixels
+    gray = pixels.shape[2] == 1
+    image = Image.fromarray(pixels[:, :, 0] if gray else pixels)
+    resized = np.asarray(image.resize(tuple(size), Image.LANCZOS))
+    return resized[:, :, np.newaxis] if gray else resized
+
+
+def derive(data, size, fmt="png", level=6, text=None):
+    """
+    Downsample the image bytes `data` to `size`, and encode the result in
+    format `fmt`, returning its bytes.
+
+    `level` and `text` are as for `encode_pixels`.
+    """
+    pixels = downsample(decode_pixels(data), size)
+    return b"".join(encode_pixels(pixels, fmt, level=level, text=text))
+
+
+class Pyramid:
+    """
+    The levels of detail of one curve, kept in `cache`, a RenderCache.
+
+    `key(size)` makes the cache key for the level at `size`.
+    `render_master()` draws the curve at `master_size`, returning PNG bytes.
+    `flights` is a SingleFlight, so that levels are made once.
+    `derive` is called like `derive` above to make levels and images, by
+    default here.
+    """
+
+    def __init__(
+        self, cache, key, master_size, render_master, flights=None, derive=derive
+    ):
+        self.cache = cache
+        self.key = key
+        self.master_size = tuple(master_size)
+        self.render_master = render_master
+        self.flights = flights
+        self.derive = derive
+
+    def level_size(self, size):
+        """
+        The size of the smallest level at least as big as `size`.
+        """
+        width, height = self.master_size
+        while width // 2 >= size[0] and height // 2 >= size[1]:
+            width, height = width // 2, height // 2
+        return width, height
+
+    def level_above(self, size):
+        """
+        The size of the level that the level at `size` is downsampled from.
+        """
+        above = self.master_size
+        while above[0] // 2 > size[0]:
+            above = (above[0] // 2, above[1] // 2)
+        return above
+
+    def cached_level(self, size):
+        """
+        The size of the smallest level at least as big as `size` that is
+        already in the cache, or None if there isn't one.
+        """
+        level = self.level_size(size)
+        while self.key(level) not in self.cache:
+            if level == self.master_size:
+                return None
+            level = self.level_above(level)
+        return level
+
+    def level(self, size):
+        """
+        Get the PNG bytes of the level at `size`, making it if needed.
+        """
+        if size == self.master_size:
+            render = self.render_master
+        else:
+            above = self.level_above(size)
+
+            def render():
+                return self.derive(self.level(above), size, "png", LEVEL_PNG_LEVEL)
+
+        return self.cache.get_or_render(self.key(size), render, self.flights)
+
+    def image(self, size, fmt="png", level=6, text=None, from_size=None):
+        """
+        Get the bytes of the curve at `size`, which must be no bigger than
+        the master, in format `fmt`, downsampled from the level at
+        `from_size`, by default the smallest one big enough.
+
+        `level` and `text` are as for `encode_pixels`.
+        """
+        if from_size is None:
+            from_size = self.level_size(size)
+        return self.derive(self.level(from_size), size, fmt, level, text)
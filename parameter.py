@@ -5,6 +5,7 @@ Parameterized curves
 import contextlib
 import contextvars
 import dataclasses
+import functools
 from dataclasses import dataclass
 
 
@@ -70,6 +71,34 @@ class Parameter:
         else:
             return int(s)
 
+    def converters(self):
+        """
+        Get (to_short, from_short) functions with the type checks done now.
+
+        The to_short function always makes a str.
+        """
+        if isinstance(self.default, float):
+            scale, mult = self.scale, 10**self.places
+
+            def to_short(v):
+                return str(int(v / scale * mult))
+
+            def from_short(s):
+                return float(s) / mult * scale
+
+        else:
+            to_short, from_short = str, int
+        # Parameters can have their own, given to the constructor.
+        if "to_short" in vars(self):
+            custom = self.to_short
+
+            def to_short(v):
+                return str(custom(v))
+
+        if "from_short" in vars(self):
+            from_short = self.from_short
+        return to_short, from_short
+
     def repr(self, v):
         if isinstance(self.default, float):
             return format(v, f".{self.places}f")
@@ -77,6 +106,34 @@ class Parameter:
             return repr(v)
 
 
+class Schema:
+    """
+    The Parameters of a Parameterized class, worked out once.
+
+    `fields` are the dataclass fields that are Parameters, `names` their
+    names.  `defaults` maps field names to default values, `by_key` maps
+    Parameter keys to (field name, from_short), and `shorts` has
+    (field name, key, to_short) for writing short parameters.  The
+    converters are from `Parameter.converters`.
+    """
+
+    def __init__(self, cls):
+        self.fields = tuple(
+            field
+            for field in dataclasses.fields(cls)
+            if isinstance(field.type, Parameter)
+        )
+        self.names = tuple(field.name for field in self.fields)
+        self.defaults = {field.name: field.type.default for field in self.fields}
+        self.by_key = {}
+        shorts = []
+        for field in self.fields:
+            to_short, from_short = field.type.converters()
+            self.by_key[field.type.key] = (field.name, from_short)
+            shorts.append((field.name, field.type.key, to_short))
+        self.shorts = tuple(shorts)
+
+
 @dataclass
 class Parameterized:
     """
@@ -87,14 +144,17 @@ class Parameterized:
     # together, like an x wave and a y wave.
     name: str
 
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def schema(cls):
+        return Schema(cls)
+
     @classmethod
     def paramdefs(cls):
         """
         Get the fields that are Parameters.
         """
-        for field in dataclasses.fields(cls):
-            if isinstance(field.type, Parameter):
-                yield field
+        return cls.schema().fields
 
     @classmethod
     def make_random(cls, name, rnd):
@@ -130,14 +190,12 @@ class Parameterized:
         """
         Make an instance using the params dict for Parameter short values.
         """
-        kwargs = {}
-        for field in cls.paramdefs():
-            key = name + field.type.key
-            if key in params:
-                val = field.type.from_short(params[key])
-            else:
-                val = field.type.default
-            kwargs[field.name] = val
+        schema = cls.schema()
+        kwargs = dict(schema.defaults)
+        for key, (field_name, from_short) in schema.by_key.items():
+            val = params.get(name + key)
+            if val is not None:
+                kwargs[field_name] = from_short(val)
         return cls(name=name, **kwargs)
 
     def param_things(self):
@@ -158,12 +216,8 @@ class Parameterized:
         """
         shorts = {}
         for thing, _ in self.param_things():
-            for field in thing.paramdefs():
-                key = thing.name + field.type.key
-                val = getattr(thing, field.name)
-                if field.type.to_short:
-                    val = field.type.to_short(val)
-                shorts[key] = str(val)
+            for field_name, key, to_short in thing.schema().shorts:
+                shorts[thing.name + key] = to_short(getattr(thing, field_name))
         return shorts
 
 
@@ -0,0 +1,142 @@
+"""
+Working with PNG files at the chunk level, and writing them a band of rows
+at a time.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_chunk(ctype, data):
+    """
+    Make the bytes of a complete chunk: length, type, data, and CRC.
+    """
+    crc = zlib.crc32(data, zlib.crc32(ctype))
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", crc)
+
+
+def text_chunk(key, value):
+    """
+    Make a text chunk: tEXt if `value` is Latin-1, iTXt if it needs UTF-8.
+    """
+    key = key.encode("latin-1")
+    try:
+        return make_chunk(b"tEXt", key + b"\0" + value.encode("latin-1"))
+    except UnicodeEncodeError:
+        # Not compressed, no language tag, no translated keyword.
+        data = key + b"\0\0\0\0\0" + value.encode("utf-8")
+        return make_chunk(b"iTXt", data)
+
+
+def add_text(png, items):
+    """
+    Add text chunks for the `items` dict to the PNG bytes `png`.
+
+    The chunks are spliced in right after IHDR, the image data is untouched.
+    """
+    assert png.startswith(PNG_SIGNATURE)
+    # IHDR is always first, and always 13 bytes of data.
+    ihdr_end = len(PNG_SIGNATURE) + 8 + 13 + 4
+    chunks = b"".join(text_chunk(k, v) for k, v in items.items())
+    return png[:ihdr_end] + chunks + png[ihdr_end:]
+
+
+# PNG color types by number of channels.
+COLOR_TYPES = {1: 0, 3: 2}
+
+
+def encode_png(width, height, bands, level=6, text=None, channels=3):
+    """
+    Encode an RGB or grayscale image as PNG, producing the bytes in pieces.
+
+    `bands` produces (rows, width, channels) uint8 arrays, top to bottom,
+    totalling `height` rows.  `channels` is 3 for RGB or 1 for gray.  Each
+    band is compressed as it arrives, so the whole image never has to be in
+    memory at once.  `text` is a dict for text chunks.
+    """
+    # 8-bit samples, deflate, adaptive filtering, no interlace.
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, COLOR_TYPES[channels], 0, 0, 0)
+    head = PNG_SIGNATURE + make_chunk(b"IHDR", ihdr)
+    if text:
+        head += b"".join(text_chunk(k, v) for k, v in text.items())
+    yield head
+    compressor = zlib.compressobj(level)
+    for band in bands:
+        data = compressor.compress(filter_rows(band))
+        if data:
+            yield make_chunk(b"IDAT", data)
+    yield make_chunk(b"IDAT", compressor.flush()) + make_chunk(b"IEND", b"")
+
+
+def filter_rows(rgb):
+    """
+    Make the PNG scanlines for the rows of `rgb`, with the Sub filter.
+
+    `rgb` is (rows, width, channels): it can be gray too.
+
+    Sub stores each byte as the difference from the pixel to its left, which
+    turns the runs of flat color in our images into runs of zeros.
+    """
+    rows, width, bpp = rgb.shape
+    raw = rgb.reshape(rows, width * bpp)
+    lines = np.empty((rows, width * bpp + 1), dtype=np.uint8)
+    lines[:, 0] = 1
+    lines[:, 1 : bpp + 1] = raw[:, :bpp]
+    np.subtract(raw[:, bpp:], raw[:, :-bpp], out=lines[:, bpp + 1 :])
+    return lines.tobytes()
+
+
+def iter_chunks(f):
+    """
+    Read the chunks from file `f`, producing (type, data) pairs.
+
+    The data of IDAT chunks isn't read: it's produced as None.
+    """
+    if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("Truncated PNG file")
+        length, ctype = struct.unpack(">I4s", header)
+        if ctype == b"IDAT":
+            f.seek(length + 4, 1)
+            data = None
+        else:
+            data = f.read(length)
+            crc = f.read(4)
+            if len(crc) < 4 or struct.unpack(">I", crc)[0] != zlib.crc32(
+                data, zlib.crc32(ctype)
+            ):
+                raise ValueError(f"Bad PNG chunk {ctype!r}")
+        yield ctype, data
+        if ctype == b"IEND":
+            break
+
+
+def read_text(f):
+    """
+    Read the text chunks from the PNG file `f` into a dict.
+    """
+    text = {}
+    for ctype, data in iter_chunks(f):
+        if ctype == b"tEXt":
+            key, _, value = data.partition(b"\0")
+            text[key.decode("latin-1")] = value.decode("latin-1")
+        elif ctype == b"zTXt":
+            key, _, value = data.partition(b"\0")
+            value = zlib.decompress(value[1:])
+            text[key.decode("latin-1")] = value.decode("latin-1")
+        elif ctype == b"iTXt":
+            key, _, rest = data.partition(b"\0")
+            compressed, _method = rest[0], rest[1]
+            _lang, _, rest = rest[2:].partition(b"\0")
+            _tkey, _, value = rest.partition(b"\0")
+            if compressed:
+                value = zlib.decompress(value)
+            text[key.decode("latin-1")] = value.decode("utf-8")
+    return text
@@ -0,0 +1,116 @@
+"""
+Render thumbnails ahead of time, in the render processes.
+
+The /one page links to dozens of thumbnails that the browser will ask for
+right away.  Rendering them as soon as the page is requested means the
+/png requests find them in the cache.
+"""
+
+import collections
+import threading
+
+from executor import Busy, render_image
+
+
+class Prerenderer:
+    """
+    Render images into `cache` on `executor`, a RenderExecutor, in its
+    "prerender" lane.
+
+    Renders are attached to `flights`, a SingleFlight, so that requests for
+    the same image wait for them instead of rendering it again.
+
+    Renders are grouped by the page that asked for them, numbered by
+    `new_page`.  When more than `max_pending` renders are waiting, the queued
+    ones of the oldest pages are cancelled: those pages have likely been left
+    behind.  The newest page's renders are never cancelled for room, however
+    many thumbnails it has.
+    """
+
+    def __init__(self, cache, executor, flights, max_pending=512, enabled=True):
+        self.cache = cache
+        self.executor = executor
+        self.flights = flights
+        self.max_pending = max_pending
+        self.enabled = enabled
+        # Re-entrant, because cancelling a future runs its callback.
+        self.lock = threading.RLock()
+        # Page number to an OrderedDict of key to future, oldest page first.
+        self.pages = collections.OrderedDict()
+        self.last_page = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.refused = 0
+        self.failed = 0
+
+    def new_page(self):
+        """
+        Start a new page of renders, and return its number for `submit`.
+        """
+        with self.lock:
+            self.last_page += 1
+            return self.last_page
+
+    def submit(self, key, params, size, fmt="png", level=6, page=None):
+        """
+        Start rendering `params` at `size` into the cache under `key`, for
+        `page`, the newest page by default.
+        """
+        if not self.enabled or key in self.cache or key in self.flights:
+            return
+        with self.lock:
+            if page is None:
+                page = self.last_page
+            while self.pages and self._pending() >= self.max_pending:
+                oldest = next(iter(self.pages))
+                if oldest == page:
+                    break
+                for future in list(self.pages.pop(oldest).values()):
+                    if future.cancel():
+                        self.cancelled += 1
+            try:
+                future = self.executor.submit(
+                    "prerender", render_image, params, size, fmt, level
+                )
+            except Busy:
+                # Renders people are waiting for come first.
+                self.refused += 1
+                return
+            if not self.flights.attach(key, future):
+                future.cancel()
+                return
+            self.pages.setdefault(page, collections.OrderedDict())[key] = future
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._done(page, key, f))
+
+    def _pending(self):
+        return sum(len(futures) for futures in self.pages.values())
+
+    def _done(self, page, key, future):
+        with self.lock:
+            futures = self.pages.get(page)
+            if futures is not None and futures.get(key) is future:
+                del futures[key]
+                if not futures:
+                    del self.pages[page]
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.failed += 1
+                return
+            self.completed += 1
+        self.cache.put(key, future.result())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "pending": self._pending(),
+                "pages": len(self.pages),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "refused": self.refused,
+                "failed": self.failed,
+            }
@@ -0,0 +1,126 @@
+"""
+Pages of random curves made ahead of time.
+
+The / page shows a grid of random curves for the visitor's settings.  A
+background thread keeps a few pages ready for each combination of settings
+recently asked for, with their images already rendered, so the page doesn't
+wait for curves to be made or drawn.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RandomPool:
+    """
+    Keep up to `depth` pages from `make_page(*settings)` for each of the
+    `max_settings` most recently used settings.
+    """
+
+    # Seconds to wait after make_page fails before trying again.
+    RETRY_DELAY = 1
+    # Failures in a row after which settings are dropped, until they're
+    # asked for again.
+    MAX_FAILURES = 3
+
+    def __init__(self, make_page, depth=2, max_settings=16):
+        self.make_page = make_page
+        self.depth = depth
+        self.max_settings = max_settings
+        self.lock = threading.Lock()
+        self.wanted = threading.Condition(self.lock)
+        self.pages = collections.OrderedDict()
+        # Failures in a row, by settings.
+        self.failures = {}
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+        self.made = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def take(self, settings):
+        """
+        Take a ready page for `settings`, or return None if there isn't one.
+
+        Either way, the pool will keep pages ready for `settings`.
+        """
+        if not self.depth:
+            return None
+        with self.lock:
+            if self.thread is None:
+                # Started on first use, so that each gunicorn worker gets its
+                # own, after gunicorn has forked.
+                self.thread = threading.Thread(target=self._fill, daemon=True)
+                self.thread.start()
+            pages = self.pages.setdefault(settings, collections.deque())
+            self.pages.move_to_end(settings)
+            while len(self.pages) > self.max_settings:
+                old_settings, _ = self.pages.popitem(last=False)
+                self.failures.pop(old_settings, None)
+            if pages:
+                self.hits += 1
+                page = pages.popleft()
+            else:
+                self.misses += 1
+                page = None
+            self.wanted.notify()
+        return page
+
+    def stats(self):
+        with self.lock:
+            return {
+                "settings": len(self.pages),
+                "ready": sum(len(pages) for pages in self.pages.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "made": self.made,
+                "failed": self.failed,
+                "dropped": self.dropped,
+            }
+
+    def _next_settings(self):
+        """
+        The most recently used settings that are short of pages, or None.
+        """
+        for settings, pages in reversed(self.pages.items()):
+            if len(pages) < self.depth:
+                return settings
+        return None
+
+    def _fill(self):
+        while True:
+            with self.lock:
+                settings = self._next_settings()
+                while settings is None:
+                    self.wanted.wait()
+                    settings = self._next_settings()
+            try:
+                page = self.make_page(*settings)
+            except Exception:
+                with self.lock:
+                    self.failed += 1
+                    failures = self.failures.get(settings, 0) + 1
+                    self.failures[settings] = failures
+                    if failures >= self.MAX_FAILURES:
+                        self.dropped += 1
+                        self.pages.pop(settings, None)
+                        del self.failures[settings]
+                if failures >= self.MAX_FAILURES:
+                    logger.exception(
+                        "Random pages for %r failed %d times, dropping them",
+                        settings,
+                        failures,
+                    )
+                time.sleep(self.RETRY_DELAY)
+                continue
+            with self.lock:
+                self.made += 1
+                self.failures.pop(settings, None)
+                pages = self.pages.get(settings)
+                if pages is not None and len(pages) < self.depth:
+                    pages.append(page)
@@ -1,26 +1,71 @@
-import colorsys
+import collections
 import json
 from io import BytesIO
 
 import cairo
-from PIL import Image, PngImagePlugin
+import numpy as np
 
 from constants import PNG_STATE_KEY
+from pngfile import add_text
+from simplify import simplify_points
+from svg import PathData, path_data, quantize, svg_color, svg_path
 
 
 class Render:
     extras = []
+    # True if everything drawn is a shade of gray, so one channel will do.
+    monochrome = False
     DTS = [(400, 0.02), (1000, 0.01), (9999999, 0.001)]
+    # When fitting, the fraction of the canvas to leave empty on each side.
+    FIT_MARGIN = 0.02
+    # When sampling adaptively, how far in pixels the drawn line can stray.
+    MAX_ERROR = 0.5
+    # The most points to compute and draw at once.
+    CHUNK = 65536
+    # When simplifying, how far in pixels a dropped point can be from the line.
+    TOLERANCE = 0.25
 
-    def __init__(self, linewidth=5, alpha=1, bg=1):
+    def __init__(
+        self,
+        linewidth=5,
+        alpha=1,
+        bg=1,
+        fit=False,
+        adaptive=False,
+        simplify=False,
+        lod=False,
+    ):
         self.linewidth = linewidth
         self.alpha = alpha
         self.bg = bg
+        self.fit = fit
+        self.adaptive = adaptive
+        self.simplify = simplify
+        # True if smaller sizes can be downsampled from a larger raster.  The
+        # result is close to drawing at the size, not the same: the larger
+        # raster is sampled more finely, and filtering softens the edges.
+        # Wide, faint lines hide that; hairlines don't.
+        self.lod = lod
 
-    def draw(self, surface, size, curve):
+    def derives(self, size, master_size):
+        """
+        Can an image at `size` be downsampled from one at `master_size`?
+
+        The drawing is scaled to the smaller dimension and centered, so only
+        sizes with the master's shape scale down to the same picture.
+        """
+        (width, height), (mwidth, mheight) = size, master_size
+        return self.lod and width <= mwidth and width * mheight == height * mwidth
+
+    def draw(self, surface, size, curve, points=None):
+        """
+        Draw `curve` on `surface`.
+
+        `points` can be the curve's points for dims x, y, j, k at this size's
+        dt, if they have already been computed.
+        """
         self.surface = surface
-        self.width, self.height = size
-        self.dt = lookup(self.width, self.DTS)
+        self.prepare(size, curve, points)
         ctx = cairo.Context(surface)
         ctx.rectangle(0, 0, self.width, self.height)
         ctx.set_source_rgba(self.bg, self.bg, self.bg, 1)
@@ -31,8 +76,127 @@ class Render:
         self.draw_curve(ctx, size, curve)
         curve.draw_more(ctx)
 
+    def prepare(self, size, curve, points=None):
+        """
+        Set up the sampling and the transform for drawing `curve` at `size`.
+        """
+        self.width, self.height = size
+        self.points = points
+        self.dt = lookup(self.width, self.DTS)
+        self.scale = min(self.width, self.height)
+        self.offset = (0.0, 0.0)
+        if self.fit:
+            self.fit_to(curve)
+
+    def draw_curve(self, ctx, size, curve):
+        for pts in self.sample_chunks(curve, ["x", "y"] + self.extras):
+            self.draw_points(ctx, pts)
+
+    def draw_points(self, ctx, pts):
+        """
+        Draw a chunk of points, already in canvas coordinates.
+        """
+        self.draw_runs(ctx, [pts], self.chunk_plan(pts))
+
+    def chunk_plan(self, pts):
+        """
+        What `draw_runs` needs to know about the whole chunk of points `pts`
+        to draw pieces of it.
+        """
+        return None
+
+    def draw_runs(self, ctx, runs, plan):
+        """
+        Draw `runs`, pieces of one chunk of points in canvas coordinates,
+        with the same strokes that drawing the whole chunk would make.
+        `plan` is the chunk's `chunk_plan`.
+        """
+        raise NotImplementedError
+
+    def fit_to(self, curve):
+        """
+        Set the scale and offset so that the curve's bounds fill the canvas.
+        """
+        (xlo, xhi), (ylo, yhi) = curve.bounds(["x", "y"])
+        if xhi <= xlo or yhi <= ylo:
+            return
+        usable = 1 - 2 * self.FIT_MARGIN
+        self.scale = usable * min(self.width / (xhi - xlo), self.height / (yhi - ylo))
+        self.offset = (-self.scale * (xlo + xhi) / 2, -self.scale * (ylo + yhi) / 2)
+
+    def sample(self, curve, dims):
+        """
+        Get the points to draw for `dims`, in canvas coordinates.
+        """
+        if self.points is not None:
+            pts = self.points[: len(dims)].copy()
+        elif self.adaptive:
+            pts = curve.adaptive_points_array(
+                dims, dt=self.dt, scale=self.scale, max_error=self.MAX_ERROR
+            )
+        else:
+            pts = curve.points_array(dims, dt=self.dt)
+        return self.simplified(self.to_canvas(pts))
+
+    def sample_chunks(self, curve, dims):
+        """
+        Produce the points to draw for `dims` in chunks, in canvas coordinates.
+
+        Each chunk after the first starts with the last point of the one
+        before, as `Curve.points_chunks` does.  Precomputed and adaptive
+        points come as one chunk.
+        """
+        if self.points is not None or self.adaptive:
+            yield self.sample(curve, dims)
+        else:
+            for pts in curve.points_chunks(dims, dt=self.dt, chunk_size=self.CHUNK):
+                yield self.simplified(self.to_canvas(pts))
+
+    def to_canvas(self, pts):
+        """
+        Convert the x and y rows of `pts` to canvas coordinates, in place.
+        """
+        pts[:2] *= self.scale
+        pts[0] += self.offset[0]
+        pts[1] += self.offset[1]
+        return pts
+
+    def simplified(self, pts):
+        """
+        Simplify canvas points `pts`, if this render simplifies.
+
+        The ends are always kept, so chunks still meet.
+        """
+        if not self.simplify:
+            return pts
+        return simplify_points(pts, self.TOLERANCE)
+
     def set_line_width(self, ctx, width_tweak):
-        ctx.set_line_width(self.width * self.linewidth * width_tweak / 10000)
+        ctx.set_line_width(self.line_width(width_tweak))
+
+    def line_width(self, width_tweak):
+        return self.width * self.linewidth * width_tweak / 10000
+
+    def svg_paths(self, chunks, unit):
+        """
+        Make the SVG elements to draw `chunks` of points in canvas
+        coordinates, as `sample_chunks` produces them.
+
+        Coordinates are written in steps of 1/`unit` of a pixel.
+        """
+        raise NotImplementedError
+
+    def padding(self, pts):
+        """
+        How far from its points, in pixels, drawing `pts` can put ink.
+        """
+        line_width = self.line_width(self.max_width_tweak(pts))
+        # A miter join can reach miter-limit (10 by default) half-widths out,
+        # and antialiasing reaches a pixel further.
+        return 5 * line_width + 1
+
+    def max_width_tweak(self, pts):
+        return 1
 
 
 def lookup(x, choices):
@@ -45,6 +209,8 @@ def lookup(x, choices):
 
 
 class ElegantLine(Render):
+    monochrome = True
+
     def __init__(self, gray=0, **kwargs):
         super().__init__(**kwargs)
         self.gray = gray
@@ -52,49 +218,272 @@ class ElegantLine(Render):
         # for this renderer, which draws the whole image as one line.
         assert self.alpha == 1
 
-    def draw_curve(self, ctx, size, curve):
+    def draw_runs(self, ctx, runs, plan):
+        # Stroking each chunk keeps Cairo's path small too.  The line is
+        # opaque, so the chunks overlapping at their ends don't show.  The
+        # pieces of a chunk are one stroke, so where they cross, the edges
+        # are antialiased once, as for the whole chunk.
         ctx.set_source_rgb(self.gray, self.gray, self.gray)
-        maxsize = min(self.width, self.height)
-        for i, (x, y) in enumerate(curve.points(["x", "y"], dt=self.dt)):
-            if i == 0:
-                ctx.move_to(x * maxsize, y * maxsize)
-            else:
-                ctx.line_to(x * maxsize, y * maxsize)
+        for run in runs:
+            polyline(ctx, *run.tolist())
         ctx.stroke()
 
+    def svg_paths(self, chunks, unit):
+        # One path for the whole line: each chunk carries on from the last
+        # point of the one before.
+        data = "".join(
+            path_data(*quantize(pts, unit), continued=i > 0)
+            for i, pts in enumerate(chunks)
+        )
+        return [
+            svg_path(
+                data,
+                stroke=svg_color(self.gray, self.gray, self.gray),
+                stroke_width=self.line_width(1) * unit,
+                # Cairo's default, SVG's is 4.
+                stroke_miterlimit=10,
+            )
+        ]
+
+
+def polyline(ctx, xs, ys):
+    """
+    Add a polyline through the points to the current path of `ctx`.
+
+    `xs` and `ys` are lists of floats.  pycairo has no way to hand it a whole
+    path, so the `line_to` calls are driven by `map`: the loop runs in C
+    instead of as Python bytecode for every point.
+    """
+    if not xs:
+        return
+    ctx.move_to(xs[0], ys[0])
+    collections.deque(map(ctx.line_to, xs[1:], ys[1:]), maxlen=0)
+
 
 class ColorLine(Render):
+    """
+    Draw each segment with a color and width taken from the "j" and "k"
+    dimensions.
+
+    By default every segment is stroked on its own, which is exact but costs
+    a Cairo stroke per sample.  Pass `bins` (a lookup table from image width
+    to a number of bins, like `ColorLine.BINS`) to quantize hue and width into
+    that many bins each, and stroke all the segments in a bin as one path.
+
+    The visual difference of binning is bounded: hue is off by at most
+    1/(2*bins) of the color wheel, so no RGB channel moves by more than
+    3/bins before alpha is applied, and width is off by at most 1/(2*bins) of
+    the range of widths in the chunk being drawn.  Two things are not
+    preserved: segments are stroked bin by bin rather than in curve order,
+    and overlapping segments in the same bin are painted once rather than
+    alpha'd over each other.
+    """
+
     extras = ["j", "k"]
+    BINS = [(400, 12), (1000, 32), (9999999, 128)]
 
-    def __init__(self, lightness=0.5, **kwargs):
+    def __init__(self, lightness=0.5, bins=None, **kwargs):
         super().__init__(**kwargs)
         self.lightness = lightness
+        self.bins = bins
+
+    def chunk_plan(self, pts):
+        if self.bins is None:
+            return None
+        return self.bin_plan(pts, lookup(self.width, self.bins))
+
+    def draw_runs(self, ctx, runs, plan):
+        if plan is None:
+            for run in runs:
+                self.draw_segments(ctx, run)
+        else:
+            self.draw_binned(ctx, runs, plan)
+
+    def max_width_tweak(self, pts):
+        return float(np.abs(pts[3]).max(initial=0)) + 1.5
+
+    def draw_segments(self, ctx, pts):
+        x, y, hue, width_tweak = pts
+        rgbs = hls_to_rgb(hue, self.lightness, 1).T.tolist()
+        x, y, width_tweak = x.tolist(), y.tolist(), width_tweak.tolist()
+        for i in range(1, len(x)):
+            r, g, b = rgbs[i]
+            ctx.set_source_rgba(r, g, b, self.alpha)
+            ctx.move_to(x[i - 1], y[i - 1])
+            ctx.line_to(x[i], y[i])
+            self.set_line_width(ctx, width_tweak[i] + 1.5)
+            ctx.stroke()
+
+    def draw_binned(self, ctx, runs, plan):
+        xs = [run[0].tolist() for run in runs]
+        ys = [run[1].tolist() for run in runs]
+        for (r, g, b), width_tweak, pieces in self.binned_runs(runs, plan):
+            ctx.set_source_rgba(r, g, b, self.alpha)
+            for i, start, end in pieces:
+                polyline(ctx, xs[i][start : end + 1], ys[i][start : end + 1])
+            self.set_line_width(ctx, width_tweak + 1.5)
+            ctx.stroke()
+
+    def svg_paths(self, chunks, unit):
+        # SVG can't draw a color per segment without an element per segment,
+        # so always bin.  Chunks are binned one at a time, as they're drawn.
+        nbins = lookup(self.width, self.bins or self.BINS)
+        paths = []
+        for pts in chunks:
+            data = PathData(*quantize(pts, unit))
+            for rgb, width_tweak, runs in self.bin_runs(pts, nbins):
+                paths.append(
+                    svg_path(
+                        data.runs(runs),
+                        stroke=svg_color(*rgb),
+                        stroke_opacity=self.alpha,
+                        stroke_width=self.line_width(width_tweak + 1.5) * unit,
+                    )
+                )
+        return paths
+
+    def bin_runs(self, pts, nbins):
+        """
+        Quantize the segments of `pts` into `nbins` hues and `nbins` widths.
+
+        Returns ((r, g, b), width_tweak, runs) for each bin used, in order of
+        first use.  The runs are (start, end) indexes of the points of
+        consecutive segments in the bin.
+        """
+        return [
+            (rgb, width_tweak, [(start, end) for _, start, end in pieces])
+            for rgb, width_tweak, pieces in self.binned_runs(
+                [pts], self.bin_plan(pts, nbins)
+            )
+        ]
+
+    def bin_plan(self, pts, nbins):
+        """
+        Plan the binning of the chunk of points `pts` into `nbins` hues and
+        `nbins` widths.
+
+        Widths are binned over the chunk's range.  Returns (nbins, lowest
+        width tweak, width step, {bin: rank}), the bins ranked by first use.
+        """
+        wt = pts[3, 1:]
+        wlo, whi = (wt.min(), wt.max()) if len(wt) else (0.0, 0.0)
+        plan = (nbins, wlo, (whi - wlo) / nbins, {})
+        seg_bin = self.segment_bins(pts, plan)
+        bins, first = np.unique(seg_bin, return_index=True)
+        ranked = bins[np.argsort(first)].tolist()
+        return plan[:3] + ({bin_: rank for rank, bin_ in enumerate(ranked)},)
+
+    def segment_bins(self, pts, plan):
+        """
+        The bin of each segment of `pts`, a piece of a chunk with `plan`.
+        """
+        nbins, wlo, wstep, _ = plan
+        # Segment i goes from point i to point i+1, and is drawn with the
+        # color and width of point i+1.
+        hue_bin = np.minimum((pts[2, 1:] % 1.0 * nbins).astype(int), nbins - 1)
+        if wstep > 0:
+            width_bin = np.minimum(
+                ((pts[3, 1:] - wlo) / wstep).astype(int), nbins - 1
+            )
+        else:
+            width_bin = np.zeros_like(hue_bin)
+        return hue_bin * nbins + width_bin
+
+    def binned_runs(self, runs, plan):
+        """
+        Group the segments of `runs`, pieces of a chunk with `plan`, by bin.
+
+        Returns ((r, g, b), width_tweak, pieces) for each bin used, in the
+        chunk's order of first use.  The pieces are (i, start, end): indexes
+        into runs[i] of the points of consecutive segments in the bin.
+        """
+        nbins, wlo, wstep, rank = plan
+        pieces_by_bin = {}
+        for i, pts in enumerate(runs):
+            if pts.shape[1] < 2:
+                continue
+            # Consecutive segments in the same bin are drawn as one polyline.
+            seg_bin = self.segment_bins(pts, plan)
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(seg_bin)) + 1])
+            ends = np.append(starts[1:], len(seg_bin))
+            for bin_, start, end in zip(
+                seg_bin[starts].tolist(), starts.tolist(), ends.tolist()
+            ):
+                pieces_by_bin.setdefault(bin_, []).append((i, start, end))
+        if not pieces_by_bin:
+            return []
+
+        bins = np.array(sorted(pieces_by_bin, key=rank.__getitem__))
+        rgbs = hls_to_rgb((bins // nbins + 0.5) / nbins, self.lightness, 1)
+        widths = wlo + (bins % nbins + 0.5) * wstep
+        return [
+            (tuple(rgb), width, pieces_by_bin[bin_])
+            for bin_, rgb, width in zip(bins.tolist(), rgbs.T.tolist(), widths.tolist())
+        ]
+
+
+def hls_to_rgb(h, l, s):
+    """
+    `colorsys.hls_to_rgb`, but for an array of hues.
+
+    Returns a (3, N) array of r, g, b.
+    """
+    if l <= 0.5:
+        m2 = l * (1.0 + s)
+    else:
+        m2 = l + s - (l * s)
+    m1 = 2.0 * l - m2
+    return np.stack(
+        [
+            _hue_value(m1, m2, h + 1 / 3),
+            _hue_value(m1, m2, h),
+            _hue_value(m1, m2, h - 1 / 3),
+        ]
+    )
 
-    def draw_curve(self, ctx, size, curve):
-        maxsize = min(self.width, self.height)
-        x0 = y0 = 0
-        for i, (x, y, hue, width_tweak) in enumerate(
-            curve.points(["x", "y", "j", "k"], dt=self.dt)
-        ):
-            if i > 0:
-                r, g, b = colorsys.hls_to_rgb(hue, self.lightness, 1)
-                ctx.set_source_rgba(r, g, b, self.alpha)
-                ctx.move_to(x0 * maxsize, y0 * maxsize)
-                ctx.line_to(x * maxsize, y * maxsize)
-                self.set_line_width(ctx, width_tweak + 1.5)
-                ctx.stroke()
-            x0, y0 = x, y
-
-
-def draw_svg(curve, size, render=None):
-    width, height = size
-    if render is None:
-        render = curve.render
-    svgio = BytesIO()
-    with cairo.SVGSurface(svgio, width, height) as surface:
-        surface.set_document_unit(cairo.SVGUnit.PX)
-        render.draw(surface, size, curve)
-    return svgio.getvalue().decode("ascii")
+
+def _hue_value(m1, m2, hue):
+    hue = hue % 1.0
+    return np.select(
+        [hue < 1 / 6, hue < 0.5, hue < 2 / 3],
+        [
+            m1 + (m2 - m1) * hue * 6.0,
+            np.full_like(hue, m2),
+            m1 + (m2 - m1) * (2 / 3 - hue) * 6.0,
+        ],
+        m1,
+    )
+
+
+def sprite_layout(ntiles, tile_size, columns):
+    """
+    Compute the (x, y) offsets of tiles in a sprite sheet, and its size.
+    """
+    tx, ty = tile_size
+    offsets = [((i % columns) * tx, (i // columns) * ty) for i in range(ntiles)]
+    rows = (ntiles + columns - 1) // columns
+    return offsets, (tx * min(ntiles, columns), ty * rows)
+
+
+def draw_sprite_png(curves, tile_size, columns, points=None):
+    """
+    Draw many curves as tiles on one surface, and return one PNG.
+
+    The tiles are arranged as `sprite_layout` says.  `points` can be the
+    curves' precomputed points, as `Render.draw` accepts them.
+    """
+    offsets, (width, height) = sprite_layout(len(curves), tile_size, columns)
+    if points is None:
+        points = [None] * len(curves)
+    with cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height) as surface:
+        for curve, pts, (x, y) in zip(curves, points, offsets):
+            tile = surface.create_for_rectangle(x, y, *tile_size)
+            curve.render.draw(tile, tile_size, curve, points=pts)
+            tile.finish()
+        pngio = BytesIO()
+        surface.write_to_png(pngio)
+    pngio.seek(0)
+    return pngio
 
 
 def draw_png(curve, size, render=None, with_metadata=False):
@@ -108,12 +497,16 @@ def draw_png(curve, size, render=None, with_metadata=False):
     pngio.seek(0)
 
     if with_metadata:
-        im = Image.open(pngio)
-        info = PngImagePlugin.PngInfo()
-        info.add_text("Software", "https://flourish.nedbat.com")
-        info.add_text(PNG_STATE_KEY, json.dumps(curve.short_parameters()))
-        pngio = BytesIO()
-        im.save(pngio, "PNG", pnginfo=info)
-        pngio.seek(0)
+        pngio = BytesIO(add_text(pngio.getvalue(), png_metadata(curve)))
 
     return pngio
+
+
+def png_metadata(curve):
+    """
+    The text chunks for a PNG of `curve`, so it can be uploaded again.
+    """
+    return {
+        "Software": "https://flourish.nedbat.com",
+        PNG_STATE_KEY: json.dumps(curve.short_parameters()),
+    }
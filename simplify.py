@@ -0,0 +1,131 @@
+"""
+Simplifying polylines: dropping points that don't change the drawing.
+
+At small sizes, many consecutive samples are within a fraction of a pixel of
+the line through their neighbors.  Ramer-Douglas-Peucker keeps the ends of a
+polyline, then recursively keeps the point furthest from the segment between
+kept points, until every dropped point is within a tolerance of the result.
+Here the recursion is done level by level, with all the intervals of a level
+handled in one set of array operations.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+# The default tolerance, in pixels.
+TOLERANCE = 0.25
+
+# Points per interval to start from.
+BLOCK = 64
+
+COUNTS = ("calls", "points_in", "points_out", "seconds")
+
+
+class SimplifyStats:
+    """
+    Counts of points simplified, and the time it took.
+
+    Simplifying happens in the render processes: each hands its counts back
+    with its results with `take`, and the web process `merge`s them into its
+    own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(COUNTS, 0)
+
+    def add(self, points_in, points_out, seconds):
+        self.merge(
+            {
+                "calls": 1,
+                "points_in": points_in,
+                "points_out": points_out,
+                "seconds": seconds,
+            }
+        )
+
+    def merge(self, counts):
+        with self.lock:
+            for name in COUNTS:
+                self.counts[name] += counts[name]
+
+    def take(self):
+        """
+        Return the counts so far, and start again from zero.
+        """
+        with self.lock:
+            counts = self.counts
+            self.counts = dict.fromkeys(COUNTS, 0)
+        return counts
+
+    def stats(self):
+        with self.lock:
+            points_in = self.counts["points_in"]
+            ratio = self.counts["points_out"] / points_in if points_in else None
+            return {**self.counts, "ratio": ratio}
+
+
+simplify_stats = SimplifyStats()
+
+
+def simplify_points(pts, tolerance=TOLERANCE):
+    """
+    Simplify the polyline in the x and y rows of `pts`.
+
+    The other rows come along for the points that are kept.  `tolerance` is
+    in the units of x and y.
+    """
+    start = time.perf_counter()
+    simpler = pts[:, rdp_keep(pts[0], pts[1], tolerance)]
+    simplify_stats.add(pts.shape[1], simpler.shape[1], time.perf_counter() - start)
+    return simpler
+
+
+def rdp_keep(x, y, tolerance, block=BLOCK):
+    """
+    Find the points of the polyline `x`, `y` to keep, as a boolean array.
+
+    Every `block`th point is kept too: starting from short intervals saves
+    the levels it would take to split the whole polyline down to them.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    # The intervals between kept points that may need splitting.
+    starts = np.arange(0, n - 1, block)
+    ends = np.append(starts[1:], n - 1)
+    keep[starts] = True
+    if n:
+        keep[-1] = True
+    while True:
+        inner = ends - starts - 1
+        starts, ends, inner = starts[inner > 0], ends[inner > 0], inner[inner > 0]
+        if not len(starts):
+            return keep
+
+        # The interior points of every interval, and which interval they're in.
+        first = np.cumsum(inner) - inner
+        which = np.repeat(np.arange(len(starts)), inner)
+        idx = np.repeat(starts + 1 - first, inner) + np.arange(inner.sum())
+
+        # Distance from each point to its interval's segment.
+        x0, y0 = x[starts][which], y[starts][which]
+        dx, dy = (x[ends] - x[starts])[which], (y[ends] - y[starts])[which]
+        px, py = x[idx] - x0, y[idx] - y0
+        length2 = dx * dx + dy * dy
+        along = np.clip(
+            (px * dx + py * dy) / np.where(length2 > 0, length2, 1), 0, 1
+        )
+        dist = np.hypot(px - along * dx, py - along * dy)
+
+        # Split each interval whose furthest point is too far, at that point.
+        furthest = np.maximum.reduceat(dist, first)
+        hits = np.flatnonzero(dist == furthest[which])
+        _, first_hit = np.unique(which[hits], return_index=True)
+        split_at = idx[hits[first_hit]]
+        split = furthest > tolerance
+        mid = split_at[split]
+        keep[mid] = True
+        starts = np.concatenate([starts[split], mid])
+        ends = np.concatenate([mid, ends[split]])
@@ -0,0 +1,169 @@
+"""
+Rendering each image once when several requests want it at the same time.
+
+When a page loads, or a link is shared, the same image is often asked for
+by several requests together.  The first becomes the leader and renders it;
+the others wait for the leader's result instead of rendering it again.
+
+Across the processes of a server, a leader takes a lock file for its key
+before rendering, and looks in the cache again once it has it: if another
+process was rendering the same image, it will have finished, and cached it.
+
+Each key has its own lock file, so a render can lead the renders it needs
+(a level of detail needs the level above it) without waiting on a lock that
+it, or a render waiting on it, already holds.  The holder removes the file
+before unlocking it, so they don't pile up.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No lock files: only renders in the same process are shared.
+    fcntl = None
+
+
+class SingleFlight:
+    """
+    Share the result of concurrent calls with the same key.
+
+    `lock_dir` is a directory for lock files, shared by the processes that
+    should share renders.
+    """
+
+    # Seconds to wait for another process's lock before rendering anyway.
+    LOCK_TIMEOUT = 30
+    LOCK_POLL = 0.01
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.leaders = 0
+        self.shared = 0
+        self.shared_across = 0
+        self.preempted = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.flights
+
+    def do(self, key, fn, check=None):
+        """
+        Return `fn()`, or the result of a call for `key` already in flight.
+
+        `check()` is called with the lock file held, and if it returns
+        anything but None, that is used instead of calling `fn()`.
+        """
+        while True:
+            with self.lock:
+                future = self.flights.get(key)
+                if future is None:
+                    future = concurrent.futures.Future()
+                    future.set_running_or_notify_cancel()
+                    self.flights[key] = future
+                    self.leaders += 1
+                    break
+            # A future that hasn't started is a queued prerender: render
+            # now rather than wait behind it.
+            if future.cancel():
+                with self.lock:
+                    self.preempted += 1
+                continue
+            try:
+                result = future.result()
+            except concurrent.futures.CancelledError:
+                # A prerender that was dropped while we waited.
+                continue
+            with self.lock:
+                self.shared += 1
+            return result
+
+        try:
+            result = self._lead(key, fn, check)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._forget(key, future)
+
+    def attach(self, key, future):
+        """
+        Make `future` the call in flight for `key`, if there isn't one.
+
+        Returns whether it was attached.
+        """
+        with self.lock:
+            if key in self.flights:
+                return False
+            self.flights[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.flights),
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "shared_across": self.shared_across,
+                "preempted": self.preempted,
+            }
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.flights.get(key) is future:
+                del self.flights[key]
+
+    def _lead(self, key, fn, check):
+        if self.lock_dir is None:
+            return fn()
+        name = hashlib.sha256(key.encode()).hexdigest()[:32]
+        path = os.path.join(self.lock_dir, f".lock-{name}")
+        lock_file = self._lock(path)
+        try:
+            if check is not None:
+                result = check()
+                if result is not None:
+                    with self.lock:
+                        self.shared_across += 1
+                    return result
+            return fn()
+        finally:
+            if lock_file is not None:
+                os.remove(path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _lock(self, path):
+        """
+        Lock the file at `path`, and return it open, or None if it can't be
+        had within LOCK_TIMEOUT.
+        """
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            lock_file = open(path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                time.sleep(self.LOCK_POLL)
+                continue
+            # The holder before us removes the file before unlocking it: if
+            # it did after we opened it, we have locked a file nobody else
+            # will see, so try again.
+            try:
+                if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(path)):
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        return None
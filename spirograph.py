@@ -3,7 +3,8 @@ from dataclasses import dataclass
 
 import numpy as np
 
-from curve import Curve
+from curve import Curve, compute_dtype
+from fastsin import sincos_wt
 from parameter import Parameter, Parameterized
 from util import abc
 
@@ -29,10 +30,10 @@ class Circle(Parameterized):
         adjacent_step=1,
     )
 
-    def __call__(self, t):
+    def __call__(self, t, grid=None):
         """Returns x,y"""
-        tt = t * self.speed + self.phase
-        return (self.r * np.sin(tt), self.r * np.cos(tt))
+        sin_tt, cos_tt = sincos_wt(self.speed, self.phase, t, grid)
+        return (self.r * sin_tt, self.r * cos_tt)
 
 
 @dataclass
@@ -75,14 +76,23 @@ class Spirograph(Curve):
         ncircles = len(self.circles)
         self.circles.append(Circle(f"c{abc(ncircles)}", r=penr, speed=speed, phase=0))
 
-    def points(self, dims, dt=0.01):
-        t = np.arange(start=0, stop=100, step=dt)
-        x = y = 0
+    def time_span(self):
+        return 0, 100
+
+    def evaluate(self, dims, t, grid=None):
+        pts = np.zeros((2, len(t)), dtype=compute_dtype.get())
         for circle in self.circles:
-            cx, cy = circle(t)
-            x += cx
-            y += cy
-        yield from zip(x, y)
+            cx, cy = circle(t, grid)
+            pts[0] += cx
+            pts[1] += cy
+        return pts
+
+    def bounds(self, dims, dt=0.01):
+        """
+        The circles can all line up, so the bound is the sum of their radii.
+        """
+        reach = sum(abs(circle.r) for circle in self.circles)
+        return np.array([[-reach, reach]] * 2)
 
     def draw_more(self, ctx):
         return
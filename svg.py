@@ -0,0 +1,118 @@
+"""
+Writing curves as SVG directly, without Cairo.
+
+Coordinates are written as integers in steps of a fraction of a pixel, with
+a scale transform to put them back, and as relative moves, which are
+shorter than absolute ones.  Cairo's SVG has every coordinate at full
+precision, absolute, and a path element per stroke.
+"""
+
+import copy
+
+import numpy as np
+
+# Decimal places of a pixel kept in coordinates.
+PRECISION = 1
+
+
+def draw_svg(curve, size, render=None, precision=PRECISION):
+    """
+    Draw `curve` as an SVG document string.
+    """
+    if render is None:
+        render = curve.render
+    # Preparing sets the size on the render, which curves of a style share.
+    render = copy.copy(render)
+    render.prepare(size, curve)
+    chunks = render.sample_chunks(curve, ["x", "y"] + render.extras)
+    unit = 10**precision
+    return svg_document(size, render.bg, unit, render.svg_paths(chunks, unit))
+
+
+def svg_document(size, bg, unit, paths):
+    """
+    Make the SVG document for path elements `paths`, in steps of 1/`unit`
+    from the middle of the canvas, on a gray `bg` background.
+    """
+    width, height = size
+    bg = svg_color(bg, bg, bg)
+    return "\n".join(
+        [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+            f'height="{height}" viewBox="0 0 {width} {height}">',
+            f'<rect width="{width}" height="{height}" fill="{bg}"/>',
+            f'<g transform="translate({width / 2:g} {height / 2:g}) '
+            f'scale({1 / unit:g})" fill="none">',
+            *paths,
+            "</g>",
+            "</svg>",
+        ]
+    )
+
+
+def quantize(pts, unit):
+    """
+    Round the x and y rows of `pts` to integer steps of 1/`unit`.
+    """
+    return np.rint(pts[:2] * unit).astype(np.int64)
+
+
+class PathData:
+    """
+    Path data for runs of a polyline through integer points `ix`, `iy`.
+
+    Every move is formatted once, so that many runs can be written cheaply.
+    """
+
+    def __init__(self, ix, iy):
+        self.xs, self.ys = ix.tolist(), iy.tolist()
+        dx, dy = np.diff(ix), np.diff(iy)
+        self.moves = list(map("{} {}".format, dx.tolist(), dy.tolist()))
+        # Points that rounded onto the one before add nothing.
+        for i in np.flatnonzero((dx == 0) & (dy == 0)).tolist():
+            self.moves[i] = ""
+
+    def runs(self, runs, continued=False):
+        """
+        Make the path data for `runs`, (start, end) indexes of points.
+
+        If `continued`, the first run carries on from the current point,
+        which must be its start, instead of moving there.
+        """
+        parts = []
+        for i, (start, end) in enumerate(runs):
+            if i or not continued:
+                parts.append(f"M{self.xs[start]} {self.ys[start]}")
+            moves = " ".join(filter(None, self.moves[start:end]))
+            if moves:
+                parts.append("l" + moves)
+        # A minus sign separates numbers as well as a space does.
+        return "".join(parts).replace(" -", "-")
+
+
+def path_data(ix, iy, continued=False):
+    """
+    Make path data for a polyline through integer points `ix`, `iy`.
+
+    If `continued`, the polyline carries on from the current point, which
+    must be its first point.
+    """
+    if not len(ix):
+        return ""
+    return PathData(ix, iy).runs([(0, len(ix) - 1)], continued)
+
+
+def svg_color(r, g, b):
+    return "#{:02x}{:02x}{:02x}".format(*(round(c * 255) for c in (r, g, b)))
+
+
+def svg_path(data, **attrs):
+    """
+    Make a <path> element, with `attrs` spelled with underscores for dashes.
+    """
+    parts = [f'<path d="{data}"']
+    for name, value in attrs.items():
+        if isinstance(value, float):
+            value = f"{value:.4g}"
+        parts.append(f'{name.replace("_", "-")}="{value}"')
+    return " ".join(parts) + "/>"
@@ -0,0 +1,94 @@
+"""
+Tests of fastsin: the block tables must agree with np.sin and np.cos.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from fastsin import BLOCK, MIN_POINTS, sin_engine, sin_grid, sincos_grid
+from harmonograph import FullWave, Harmonograph
+from parameter import global_value
+from spirograph import Circle
+
+# Angles around 2000 * 7 lose about 1e-12 to the rounding of t alone.
+MAX_ERROR = 1e-9
+
+
+def grid(n, start=1600.0, step=0.01):
+    return np.arange(n) * step + start
+
+
+@pytest.mark.parametrize("n", [2, 3, BLOCK - 1, BLOCK, BLOCK + 1, 3 * BLOCK + 17])
+@pytest.mark.parametrize("w, p", [(1.0, 0.0), (5.0031, 1.3), (-6.9, 4.0)])
+def test_sin_grid(n, w, p):
+    t = grid(n)
+    assert np.abs(sin_grid(w, p, t) - np.sin(w * t + p)).max() < MAX_ERROR
+
+
+@pytest.mark.parametrize("n", [2, 3, BLOCK - 1, BLOCK, BLOCK + 1, 3 * BLOCK + 17])
+def test_sincos_grid(n):
+    w, p, t = 5.0031, 1.3, grid(n)
+    sin_t, cos_t = sincos_grid(w, p, t)
+    assert np.abs(sin_t - np.sin(w * t + p)).max() < MAX_ERROR
+    assert np.abs(cos_t - np.cos(w * t + p)).max() < MAX_ERROR
+
+
+@pytest.mark.parametrize("block", [1, 2, 7, 64])
+def test_small_blocks(block):
+    # Many block boundaries, and a last block that is cut short.
+    w, p, t = 3.3, 0.2, grid(50 * block + 3)
+    assert len(sin_grid(w, p, t, block=block)) == len(t)
+    assert np.abs(sin_grid(w, p, t, block=block) - np.sin(w * t + p)).max() < MAX_ERROR
+    sin_t, cos_t = sincos_grid(w, p, t, block=block)
+    assert np.abs(sin_t - np.sin(w * t + p)).max() < MAX_ERROR
+    assert np.abs(cos_t - np.cos(w * t + p)).max() < MAX_ERROR
+
+
+@pytest.mark.parametrize("n", [0, 1])
+def test_fewer_than_two_points(n):
+    w, p, t = 2.5, 0.7, grid(n)
+    assert np.array_equal(sin_grid(w, p, t), np.sin(w * t + p))
+    sin_t, cos_t = sincos_grid(w, p, t)
+    assert np.array_equal(sin_t, np.sin(w * t + p))
+    assert np.array_equal(cos_t, np.cos(w * t + p))
+
+
+def evaluate(engine, fn):
+    with global_value(sin_engine, engine):
+        return fn()
+
+
+def test_full_wave_table():
+    wave = FullWave.make_random("xa", random.Random(17))
+    t = grid(MIN_POINTS + 100)
+    grid_desc = (float(t[0]), 0.01, len(t))
+    table = evaluate("table", lambda: wave(t, 1.3, grid_desc))
+    numpy = evaluate("numpy", lambda: wave(t, 1.3, grid_desc))
+    assert not np.array_equal(table, numpy), "the table wasn't used"
+    assert np.abs(table - numpy).max() < MAX_ERROR
+
+
+def test_full_wave_without_grid_uses_numpy():
+    wave = FullWave.make_random("xa", random.Random(17))
+    t = grid(MIN_POINTS + 100)
+    table = evaluate("table", lambda: wave(t, 1.0))
+    assert np.array_equal(table, evaluate("numpy", lambda: wave(t, 1.0)))
+
+
+def test_circle_table():
+    circle = Circle.make_random("ca", random.Random(17))
+    t = grid(MIN_POINTS + 100)
+    grid_desc = (float(t[0]), 0.01, len(t))
+    table = evaluate("table", lambda: circle(t, grid_desc))
+    numpy = evaluate("numpy", lambda: circle(t, grid_desc))
+    for table_xy, numpy_xy in zip(table, numpy):
+        assert np.abs(table_xy - numpy_xy).max() < MAX_ERROR
+
+
+def test_harmonograph_points():
+    harm = Harmonograph.make_random(random.Random(17), npend=3, syms="RXYN")
+    table = evaluate("table", lambda: harm.points_array(["x", "y", "j", "k"], 0.01))
+    numpy = evaluate("numpy", lambda: harm.points_array(["x", "y", "j", "k"], 0.01))
+    assert np.abs(table - numpy).max() < 1e-6
@@ -0,0 +1,41 @@
+"""
+Tests of tiled: drawing in bands must give the same pixels as drawing whole.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cairo")
+
+from PIL import Image
+
+from constants import FULLX, FULLY
+from harmonograph import STYLES, Harmonograph
+from render import draw_png
+from tiled import BAND_HEIGHT, draw_png_tiled
+
+# Not multiples of any band height below, so the last band is short.  The
+# full size has more points than one chunk.
+SIZES = [(333, 517), (FULLX, FULLY)]
+
+
+def pixels(pngio):
+    with Image.open(pngio) as im:
+        return np.asarray(im.convert("RGB"))
+
+
+@pytest.mark.parametrize("style", range(len(STYLES)))
+# Cairo itself draws a few pixels differently on surfaces only a few rows
+# high, so the bands aren't thinner than this.
+@pytest.mark.parametrize("band_height", [BAND_HEIGHT, 100])
+@pytest.mark.parametrize("size", SIZES)
+def test_tiled_matches_draw_png(style, band_height, size):
+    harm = Harmonograph.make_random(random.Random(style), npend=3, syms="RXYN")
+    harm.style = style
+    harm.render = STYLES[style]
+    whole = pixels(draw_png(harm, size))
+    tiled = pixels(draw_png_tiled(harm, size, band_height=band_height))
+    assert whole.shape == tiled.shape == (size[1], size[0], 3)
+    assert np.array_equal(whole, tiled)
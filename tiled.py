@@ -0,0 +1,189 @@
+"""
+Render very large PNGs in horizontal bands, on several processes.
+
+The curve's points are computed once, a chunk at a time.  Each band gets
+only the segments of each chunk that can touch it, found with an index of
+segments by band, and is drawn on its own small surface, possibly in
+another process.  The bands are encoded
+into one PNG as they arrive, top to bottom, so neither the full surface nor
+the full image is ever in memory, and the first bytes can be sent before the
+last band is drawn.
+"""
+
+import copy
+import sys
+from io import BytesIO
+
+import cairo
+import numpy as np
+
+from pngfile import encode_png
+from render import png_metadata
+
+# Rows per band.
+BAND_HEIGHT = 256
+
+
+def draw_png_tiled(curve, size, **kwargs):
+    """
+    Draw `curve` as `draw_png` does, one band of rows at a time.
+
+    Takes the same keyword arguments as `png_stream`.
+    """
+    return BytesIO(b"".join(png_stream(curve, size, **kwargs)))
+
+
+def png_stream(
+    curve,
+    size,
+    render=None,
+    with_metadata=False,
+    band_height=BAND_HEIGHT,
+    executor=None,
+    level=6,
+):
+    """
+    Start drawing `curve` as a PNG, and return an iterator of its bytes.
+
+    The points are computed now, the bands are drawn and encoded as the
+    iterator is consumed.  `executor` is something with a `map` method, like
+    a `concurrent.futures.ProcessPoolExecutor`, to draw the bands on.  If
+    it's None, they are drawn here.  `level` is the zlib compression level.
+    """
+    if render is None:
+        render = curve.render
+    bands = pixel_bands(curve, size, render, band_height, executor)
+    text = png_metadata(curve) if with_metadata else None
+    channels = 1 if render.monochrome else 3
+    return encode_png(*size, bands, level=level, text=text, channels=channels)
+
+
+def pixel_bands(curve, size, render, band_height=BAND_HEIGHT, executor=None):
+    """
+    Start drawing `curve`, and return an iterator of its bands of pixels.
+
+    The bands are (rows, width, channels) uint8 arrays, top to bottom.  They
+    are gray, with one channel, if `render` is monochrome, or RGB.
+    """
+    width, height = size
+    # Renders are shared by every curve of a style, and preparing one sets
+    # its size and transform, so work on a copy: other threads may be
+    # drawing with the same render.
+    render = copy.copy(render)
+    render.prepare(size, curve)
+    chunks = render.sample_chunks(curve, ["x", "y"] + render.extras)
+    bands = split_bands(chunks, height, band_height, render)
+
+    # The render goes to the workers without its surface and its points.
+    render.surface = None
+    render.points = None
+
+    tops = range(0, height, band_height)
+    jobs = [
+        (render, width, height, top, min(band_height, height - top), band)
+        for top, band in zip(tops, bands)
+    ]
+    if executor is None:
+        return map(_draw_band, jobs)
+    return executor.map(_draw_band, jobs)
+
+
+def split_bands(chunks, height, band_height, render):
+    """
+    Split `chunks` of points, as `Render.sample_chunks` produces them, into
+    bands of rows.
+
+    Returns a list with a list for each band, of (runs, plan) for each
+    chunk that touches it: the chunk's runs in the band, as `band_runs` finds
+    them, and its `Render.chunk_plan`.
+    """
+    nbands = (height + band_height - 1) // band_height
+    bands = [[] for _ in range(nbands)]
+    for pts in chunks:
+        plan = render.chunk_plan(pts)
+        runs = band_runs(pts, height, band_height, render.padding(pts))
+        for band, chunk_runs in zip(bands, runs):
+            if chunk_runs:
+                band.append((chunk_runs, plan))
+    return bands
+
+
+def band_runs(pts, height, band_height, pad):
+    """
+    Find the runs of points to draw in each band.
+
+    Segment i goes from point i to point i+1.  A segment belongs to every
+    band its rows, widened by `pad`, overlap, and so do the segments before
+    and after it.  Returns a list with a list of runs for each band, each run
+    a slice of `pts` with its consecutive segments in curve order.
+    """
+    nbands = (height + band_height - 1) // band_height
+    if pts.shape[1] < 2:
+        return [[] for _ in range(nbands)]
+    # Rows are measured from the top, canvas y from the middle.
+    y = pts[1] + height / 2
+    lo = np.minimum(y[:-1], y[1:]) - pad
+    hi = np.maximum(y[:-1], y[1:]) + pad
+    first = np.floor(np.clip(lo, 0, height - 1) / band_height).astype(np.intp)
+    last = np.floor(np.clip(hi, 0, height - 1) / band_height).astype(np.intp)
+    count = np.where((hi >= 0) & (lo < height), last - first + 1, 0)
+
+    # One entry per (segment, band) pair, grouped by band with the segments
+    # still in order.
+    starts = np.cumsum(count) - count
+    nth = np.arange(count.sum()) - np.repeat(starts, count)
+    band_of = np.repeat(first, count) + nth
+    seg_of = np.repeat(np.arange(len(count)), count)
+    order = np.argsort(band_of, kind="stable")
+    segs_by_band = seg_of[order]
+    bounds = np.searchsorted(band_of[order], np.arange(nbands + 1))
+
+    runs = []
+    for b in range(nbands):
+        segs = segs_by_band[bounds[b] : bounds[b + 1]]
+        if not len(segs):
+            runs.append([])
+            continue
+        # Cairo's outline of a segment depends on the joins at its ends, so
+        # with the segments on either side too, the band's segments are
+        # stroked exactly as in the whole curve.
+        segs = np.unique(np.concatenate([segs - 1, segs, segs + 1]))
+        segs = segs[(segs >= 0) & (segs < len(count))]
+        breaks = np.flatnonzero(np.diff(segs) != 1) + 1
+        run_starts = segs[np.concatenate([[0], breaks])]
+        run_ends = segs[np.append(breaks, len(segs)) - 1] + 1
+        runs.append(
+            [pts[:, a : e + 1] for a, e in zip(run_starts.tolist(), run_ends.tolist())]
+        )
+    return runs
+
+
+def _draw_band(job):
+    """
+    Draw one band, and return its pixels as `pixel_bands` produces them.
+
+    This is what runs in the worker processes.
+    """
+    render, width, height, top, rows, chunks = job
+    with cairo.ImageSurface(cairo.FORMAT_ARGB32, width, rows) as surface:
+        ctx = cairo.Context(surface)
+        ctx.rectangle(0, 0, width, rows)
+        ctx.set_source_rgba(render.bg, render.bg, render.bg, 1)
+        ctx.fill()
+        ctx.translate(width / 2, height / 2 - top)
+        render.set_line_width(ctx, 1)
+        for runs, plan in chunks:
+            render.draw_runs(ctx, runs, plan)
+        surface.flush()
+        pixels = np.frombuffer(surface.get_data(), dtype=np.uint8)
+        pixels = pixels.reshape(rows, surface.get_stride())[:, : width * 4]
+        pixels = pixels.reshape(rows, width, 4)
+        # ARGB32 is a native-endian 32-bit value.  The background is opaque,
+        # so the premultiplied colors are the plain colors.
+        if sys.byteorder == "little":
+            pixels = pixels[:, :, 2::-1]
+        else:
+            pixels = pixels[:, :, 1:]
+        if render.monochrome:
+            pixels = pixels[:, :, :1]
+        return pixels.copy()
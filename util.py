@@ -1,8 +1,9 @@
 """Miscellaneous stuff."""
 
-import itertools
 import re
 
+SLUG_ITEM = re.compile(r"([a-z]+)(-?\d+)")
+
 
 def dict_to_slug(d):
     """
@@ -10,7 +11,7 @@ def dict_to_slug(d):
 
     For use with slug_to_dict, so the values must be integers (ironically).
     """
-    return "".join(itertools.chain.from_iterable((k, str(v)) for k, v in d.items()))
+    return "".join(map("{}{}".format, d.keys(), d.values()))
 
 
 def slug_to_dict(s):
@@ -19,7 +20,7 @@ def slug_to_dict(s):
 
     abc123def456x-76y99 becomes {"abc": "123", "def": "456", "x": "-76", "y": "99"}
     """
-    return dict(re.findall(r"([a-z]+)(-?\d+)", s))
+    return dict(SLUG_ITEM.findall(s))
 
 
 def abc(i):
@@ -16,7 +16,7 @@ async function loadPyodideAndPackages() {
     // This is *not* an optimal practice (loading files individually)
     // The correct practice is to create a zip archive, such as py/py.zip
     // Or install from pypi
-    let pythonFiles = ['py/cairo.py', 'py/PIL.py', '../parameter.py', '../constants.py', '../render.py', '../curve.py', '../util.py', '../spirograph.py', '../harmonograph.py', 'py/flourish.py', 'py/pythonrender.py'];
+    let pythonFiles = ['py/cairo.py', 'py/PIL.py', '../parameter.py', '../constants.py', '../render.py', '../pngfile.py', '../simplify.py', '../svg.py', '../curve.py', '../fastsin.py', '../util.py', '../spirograph.py', '../harmonograph.py', 'py/flourish.py', 'py/pythonrender.py'];
     for (let file of pythonFiles) {
         let response = await fetch(file);
         let content = await response.text();
@@ -53,6 +53,10 @@ async function generateGraph() {
 
         const width = mycanvas.width / pixelRatio / pixelRatio;
         const height = mycanvas.height / pixelRatio / pixelRatio;
+
+        // The points are scaled to this many pixels, so Python can drop the
+        // ones that won't show.
+        drawPixels = Math.max(mycanvas.width, mycanvas.height) / pixelRatio;
     } else {
         // clear the svg
         const svgElem = document.getElementById("svgEl");
@@ -62,6 +66,8 @@ async function generateGraph() {
 
         pixelRatio = 1 // FIXME: maybe devicePixelRatio, need to test
         // SVG
+        const viewBoxValues = svgElem.getAttribute('viewBox').split(' ').map(parseFloat);
+        drawPixels = Math.max(viewBoxValues[2], viewBoxValues[3]);
     }
 
     graphStyle = "harmonograph";
@@ -106,7 +112,7 @@ async function generateGraph() {
             import sys
 
             # This is some pyodide magic: variables defined in the global scope can be imported
-            from js import pixelRatio, pythonDrawElement, graphStyle, gears, mainCircleRadius, randomSeed, dt
+            from js import pixelRatio, pythonDrawElement, graphStyle, gears, mainCircleRadius, randomSeed, dt, drawPixels
 
             sys.path.append('py')
             print("Initialized")
@@ -115,7 +121,7 @@ async function generateGraph() {
 
             # Set canvas_element only if you want this rendered in Python (slower)
             print(gears)
-            curve_points_x, curve_points_y = flourish.generate(style = graphStyle, canvas_element = pythonDrawElement, scale_ratio = pixelRatio, main_circle_radius = mainCircleRadius, spirogears = gears, random_seed = randomSeed, dt = dt)
+            curve_points_x, curve_points_y = flourish.generate(style = graphStyle, canvas_element = pythonDrawElement, scale_ratio = pixelRatio, main_circle_radius = mainCircleRadius, spirogears = gears, random_seed = randomSeed, dt = dt, pixels = drawPixels)
             print(f"# of data points: {len(curve_points_x)}")
 
             `;
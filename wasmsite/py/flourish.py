@@ -8,6 +8,7 @@ import random
 from harmonograph import Harmonograph
 from spirograph import Spirograph
 from render import ElegantLine, ColorLine
+from simplify import TOLERANCE, simplify_points
 import pythonrender
 import math
 
@@ -61,17 +62,11 @@ def get_points(style, dt, spirogears, main_circle_radius, random_seed):
     else:
         curve = Harmonograph.make_random(random, npend=2, syms=['X', 'Y', 'R'])
         
-    xs = []
-    ys = []
-
-    # TODO: Change points() so it returns the points, rather than going from a List to a Generator and back to a List
-    for x,y in curve.points(["x", "y"], dt):
-        xs.append(x)
-        ys.append(y)
+    xs, ys = curve.points_array(["x", "y"], dt)
     print("get_points: Done")
     return xs, ys
 
-def generate(style = "harmonograph", canvas_element = "harmonographCanvas", scale_ratio = 1, dt = .002, spirogears = None, main_circle_radius = None, random_seed = None):
+def generate(style = "harmonograph", canvas_element = "harmonographCanvas", scale_ratio = 1, dt = .002, spirogears = None, main_circle_radius = None, random_seed = None, pixels = None):
     print("Generating: Started")
     print(f"{style=}")
     xs, ys = get_points(style=style, dt=dt, spirogears=spirogears, main_circle_radius=main_circle_radius, random_seed = random_seed)
@@ -97,7 +92,11 @@ def generate(style = "harmonograph", canvas_element = "harmonographCanvas", scal
 
         xs = desired_min + (desired_max - desired_min) * (xs - min_val) / (max_val - min_val)
         ys = desired_min + (desired_max - desired_min) * (ys - min_val) / (max_val - min_val)
-        
+
+        if pixels:
+            # 0 to 1 is drawn across `pixels`: drop points that won't show.
+            xs, ys = simplify_points(np.vstack((xs, ys)), TOLERANCE / pixels)
+
         return xs, ys
     else:
         # If we have a canvas_element, we can draw the points directly here
@@ -0,0 +1,145 @@
+"""
+Memoized evaluation of waves.
+
+Curves that differ in one parameter (like the adjacent thumbnails on /one)
+share most of their waves.  Caching each wave's values on a time grid, and
+the sums of the waves in a dimension, means a new curve only has to evaluate
+the waves that changed.
+"""
+
+import collections
+import threading
+
+import numpy as np
+
+
+def wave_key(wave, density):
+    return (density,) + tuple(getattr(wave, name) for name in wave.schema().names)
+
+
+class WaveCache:
+    """
+    An LRU of wave values and dimension sums, bounded by total size.
+
+    `grid` arguments are hashable descriptions of the time array `t`, so
+    that values for the same waves on the same times can be found again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        # Dimension sums, by (grid, number of waves), so that we can find one
+        # that differs by a single wave.
+        self.sums = collections.defaultdict(set)
+        self.wave_hits = 0
+        self.wave_misses = 0
+        self.sum_hits = 0
+        self.sum_patches = 0
+        self.sum_misses = 0
+
+    def wave(self, wave, density, grid, t):
+        """
+        Get `wave(t, density, grid)`, evaluating it only if needed.
+        """
+        key = ("wave", grid, wave_key(wave, density))
+        val = self._get(key)
+        if val is None:
+            self._count("wave_misses")
+            val = wave(t, density, grid)
+            self._put(key, val)
+        else:
+            self._count("wave_hits")
+        return val
+
+    def dim_sum(self, waves, density, grid, t):
+        """
+        Get the sum of `waves` evaluated at `t`.
+
+        The result is shared, don't modify it.
+        """
+        wkeys = tuple(wave_key(wave, density) for wave in waves)
+        key = ("sum", grid, wkeys)
+        val = self._get(key)
+        if val is not None:
+            self._count("sum_hits")
+            return val
+
+        near = self._find_near(grid, wkeys)
+        if near is not None:
+            # Only one wave is different: take it out and put the new one in.
+            self._count("sum_patches")
+            near_val, old_val, i = near
+            val = near_val - old_val
+            val += self.wave(waves[i], density, grid, t)
+        else:
+            self._count("sum_misses")
+            val = np.zeros_like(t)
+            for wave in waves:
+                val += self.wave(wave, density, grid, t)
+
+        self._put(key, val)
+        return val
+
+    def stats(self):
+        with self.lock:
+            return {
+                "wave_hits": self.wave_hits,
+                "wave_misses": self.wave_misses,
+                "sum_hits": self.sum_hits,
+                "sum_patches": self.sum_patches,
+                "sum_misses": self.sum_misses,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _find_near(self, grid, wkeys):
+        """
+        Find a cached sum on `grid` whose waves differ from `wkeys` in one
+        place, and whose differing wave is cached too.  Returns the sum's
+        value, the differing wave's value, and the differing index.
+        """
+        with self.lock:
+            for other in self.sums.get((grid, len(wkeys)), ()):
+                diffs = [i for i, (a, b) in enumerate(zip(other, wkeys)) if a != b]
+                if len(diffs) != 1:
+                    continue
+                i = diffs[0]
+                old_val = self.entries.get(("wave", grid, other[i]))
+                if old_val is not None:
+                    return self.entries[("sum", grid, other)], old_val, i
+        return None
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get(self, key):
+        with self.lock:
+            val = self.entries.get(key)
+            if val is not None:
+                self.entries.move_to_end(key)
+            return val
+
+    def _put(self, key, val):
+        if val.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = val
+            self.nbytes += val.nbytes
+            if key[0] == "sum":
+                self.sums[(key[1], len(key[2]))].add(key[2])
+            while self.nbytes > self.max_bytes:
+                old_key, old_val = self.entries.popitem(last=False)
+                self.nbytes -= old_val.nbytes
+                if old_key[0] == "sum":
+                    sums_key = (old_key[1], len(old_key[2]))
+                    self.sums[sums_key].discard(old_key[2])
+                    # Grids include the start time and density, so there's
+                    # no end to them: don't keep empty sets.
+                    if not self.sums[sums_key]:
+                        del self.sums[sums_key]
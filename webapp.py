@@ -1,7 +1,9 @@
+import functools
 import hashlib
 import json
 import os
 import random
+import re
 import textwrap
 from dataclasses import dataclass
 from io import BytesIO
@@ -10,55 +12,246 @@ from dataclasses_json import dataclass_json
 from dotenv import load_dotenv
 from flask import (
     Flask,
+    abort,
     request,
     render_template,
-    render_template_string,
     make_response,
     redirect,
     send_file,
 )
 from flask_wtf import FlaskForm
-from PIL import Image
 from wtforms import BooleanField, IntegerField
 from wtforms.widgets import NumberInput
 from wtforms.validators import DataRequired
 
+from cache import RenderCache, cache_key, curve_key
 from constants import FULLX, FULLY, MANY_SETTINGS_COOKIE, PNG_STATE_KEY, THUMBX, THUMBY
+from executor import Busy, RenderExecutor, render_image, render_sprite, render_svg
 from harmonograph import Harmonograph
-from render import draw_png, draw_svg
+from imageformat import MIMETYPES, negotiate
+from lod import LEVEL_PNG_LEVEL, Pyramid, derive
+from pngfile import read_text
+from prerender import Prerenderer
+from randompool import RandomPool
+from render import png_metadata, sprite_layout
+from simplify import simplify_stats
+from singleflight import SingleFlight
 from util import dict_to_slug, slug_to_dict
 
 load_dotenv()
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
 
+render_cache = RenderCache(
+    max_bytes=int(os.environ.get("FLOURISH_CACHE_MB", "64")) * 1024 * 1024,
+    directory=os.environ.get("FLOURISH_CACHE_DIR"),
+    max_disk_bytes=int(os.environ.get("FLOURISH_CACHE_DISK_MB", "1024")) * 1024 * 1024,
+)
+# Drawing is done on these processes, so the request threads stay free.
+executor = RenderExecutor(
+    workers=int(os.environ.get("FLOURISH_RENDER_WORKERS", "2")),
+)
+# Identical renders requested together are done once, across the server's
+# processes if they share a cache directory.
+flights = SingleFlight(lock_dir=render_cache.directory)
+prerenderer = Prerenderer(
+    render_cache,
+    executor,
+    flights,
+    enabled=os.environ.get("FLOURISH_PRERENDER", "1") != "0",
+)
+# zlib compression levels for the PNGs each endpoint streams: thumbnails
+# are many and small, so favor speed; downloads are kept, so favor size.
+PNG_LEVELS = {
+    "png": int(os.environ.get("FLOURISH_PNG_LEVEL", "1")),
+    "download": int(os.environ.get("FLOURISH_DOWNLOAD_LEVEL", "9")),
+}
+# With FLOURISH_LOD=1, full-size downloads of styles that allow it are kept
+# as masters, and smaller images of those curves are derived from them.
+LOD_MASTER = (FULLX, FULLY) if os.environ.get("FLOURISH_LOD") == "1" else None
+
+
+def lod_pyramid(harm, params, lane):
+    """
+    The levels of detail of the curve with short `params`, drawing the master
+    and deriving the levels and images in `lane` of the executor.
+    """
+    return Pyramid(
+        render_cache,
+        key=lambda size: curve_key(harm, "lod", size),
+        master_size=LOD_MASTER,
+        render_master=lambda: executor.run(
+            lane, render_image, params, LOD_MASTER, "png", LEVEL_PNG_LEVEL
+        ),
+        flights=flights,
+        derive=functools.partial(executor.run, lane, derive),
+    )
+
+
+def uses_lod(harm, size):
+    return LOD_MASTER is not None and harm.render.derives(size, LOD_MASTER)
+
+
+THUMB_HTML = """
+    <span>
+        <a href="{{url}}" {% if title %}title="{{ title }}"{% endif %}>
+            <div class="thumb">
+                {% if sprite %}
+                <div style="
+                    width: {{sx}}px; height: {{sy}}px;
+                    background: url({{sprite.url}})
+                        -{{sprite.x}}px -{{sprite.y}}px /
+                        {{sprite.sheet_x}}px {{sprite.sheet_y}}px;
+                "></div>
+                {% else %}
+                <img src={{pngurl}} width="{{sx}}" height="{{sy}}" />
+                {% endif %}
+            </div>
+        </a>
+    </span>
+"""
+# Compiled once: render_template_string would compile it for every thumb.
+thumb_template = app.jinja_env.from_string(THUMB_HTML)
+
 
 @dataclass
 class Thumb:
     harm: Harmonograph
     size: object
+    # If set, a Sprite: the thumb is a tile in a sprite sheet.
+    sprite: object = None
+
+    @functools.cached_property
+    def shorts(self):
+        return self.harm.short_parameters()
+
+    def png_params(self):
+        """
+        The parameters for the /png url, which renders at 2x for hi-dpi.
+        """
+        return {
+            **self.shorts,
+            "sx": self.size[0] * 2,
+            "sy": self.size[1] * 2,
+        }
+
+    def prerender(self, fmt="png", page=None):
+        """
+        Start rendering the thumbnail in format `fmt` so it's cached when the
+        browser asks.  `page` is from `prerenderer.new_page`.
+        """
+        params = self.png_params()
+        # Key on the curve as /png will parse it from the url.
+        harm = Harmonograph.make_from_short_params(params)
+        size = (params["sx"], params["sy"])
+        level = PNG_LEVELS["png"]
+        key = curve_key(harm, "png", size, level=level, fmt=fmt)
+        prerenderer.submit(key, params, size, fmt, level, page=page)
 
     def as_html(self, title=None):
-        url = one_url("/one", self.harm)
-        sx = self.size[0]
-        sy = self.size[1]
-        pngurl = one_url("/png", self.harm, sx=sx * 2, sy=sy * 2)
-        return render_template_string(
-            """
-            <span>
-                <a href="{{url}}" {% if title %}title="{{ title }}"{% endif %}>
-                    <div class="thumb">
-                        <img src={{pngurl}} width="{{sx}}" height="{{sy}}" />
-                    </div>
-                </a>
-            </span>
-            """,
-            url=url,
-            pngurl=pngurl,
-            sx=sx,
-            sy=sy,
+        return thumb_template.render(
+            url="/one/" + dict_to_slug(self.shorts),
+            pngurl="/png/" + dict_to_slug(self.png_params()),
+            sx=self.size[0],
+            sy=self.size[1],
             title=title,
+            sprite=self.sprite,
+        )
+
+
+@dataclass
+class Sprite:
+    """
+    Where a thumb is in a sprite sheet, all in CSS pixels.
+    """
+
+    url: str
+    x: int
+    y: int
+    sheet_x: int
+    sheet_y: int
+
+
+SPRITE_COLUMNS = 6
+
+
+def use_sprite_sheet(thumbs, sheet_id):
+    """
+    Put all the thumbs (which must be the same size) into the sprite sheet
+    /sprite/`sheet_id`.
+    """
+    sx, sy = thumbs[0].size
+    offsets, (sheet_x, sheet_y) = sprite_layout(
+        len(thumbs), (sx, sy), SPRITE_COLUMNS
+    )
+    for thumb, (x, y) in zip(thumbs, offsets):
+        thumb.sprite = Sprite(f"/sprite/{sheet_id}", x, y, sheet_x, sheet_y)
+
+
+RANDOM_PAGE_THUMBS = 30
+
+# A random page's sheet id: its settings and seed, so any process can make
+# its curves again, and a digest of them, so a sheet made by different code
+# isn't mistaken for it.  The number of pendulums is limited to what the
+# settings form allows.
+RANDOM_SHEET_ID = re.compile(r"([1-9])-([RXYN]{1,4})-(\d+)-([0-9a-f]{16})")
+
+
+def make_random_page(npend, syms, seed=None):
+    """
+    Make the thumbs of random curves for a / page, in a sprite sheet.
+
+    Returns the thumbs, the sheet's id, and the /png slugs of its tiles.
+    """
+    if seed is None:
+        seed = random.getrandbits(32)
+    rnd = random.Random(seed)
+    size = (THUMBX, THUMBY)
+    thumbs = [
+        Thumb(Harmonograph.make_random(rnd, npend=npend, syms=syms), size=size)
+        for _ in range(RANDOM_PAGE_THUMBS)
+    ]
+    slugs = [dict_to_slug(thumb.png_params()) for thumb in thumbs]
+    digest = cache_key("sheet", slugs)[:16]
+    sheet_id = f"{npend}-{syms}-{seed}-{digest}"
+    use_sprite_sheet(thumbs, sheet_id)
+    return thumbs, sheet_id, slugs
+
+
+def random_sheet_slugs(sheet_id):
+    """
+    Get the /png slugs of the tiles of the random page sheet `sheet_id`, or
+    None if it isn't one.
+    """
+    match = RANDOM_SHEET_ID.fullmatch(sheet_id)
+    if match is None:
+        return None
+    npend, syms, seed, _ = match.groups()
+    _, made_id, slugs = make_random_page(int(npend), syms, int(seed))
+    return slugs if made_id == sheet_id else None
+
+
+def make_pooled_page(npend, syms):
+    """
+    Make a / page for the pool, with its sprite sheet rendered.
+    """
+    thumbs, sheet_id, slugs = make_random_page(npend, syms)
+    try:
+        render_cache.get_or_render(
+            cache_key("sprite", sheet_id),
+            lambda: executor.run("prerender", render_sprite, slugs, SPRITE_COLUMNS),
+            flights,
         )
+    except Busy:
+        # It will be drawn when the page asks for it.
+        pass
+    return thumbs
+
+
+random_pool = RandomPool(
+    make_pooled_page,
+    depth=int(os.environ.get("FLOURISH_POOL_PAGES", "2")),
+)
 
 
 @dataclass_json
@@ -100,12 +293,11 @@ def many():
     if settings.no_symmetry:
         syms += "N"
 
-    size = (THUMBX, THUMBY)
     thumbs = []
     if syms:
-        while len(thumbs) < 30:
-            harm = Harmonograph.make_random(random, npend=settings.npend, syms=syms)
-            thumbs.append(Thumb(harm, size=size))
+        thumbs = random_pool.take((settings.npend, syms))
+        if thumbs is None:
+            thumbs, _, _ = make_random_page(settings.npend, syms)
     form = ManySettingsForm(obj=settings)
     return render_template("many.html", thumbs=thumbs, form=form)
 
@@ -122,11 +314,13 @@ def manysettings():
 
 @app.route("/one/<path:slug>")
 def one(slug):
-    params = slug_to_dict(slug)
-    harm = Harmonograph.make_from_short_params(params)
-    svg = draw_svg(curve=harm, size=(FULLX // 2, FULLY // 2))
+    slug_params = slug_to_dict(slug)
+    harm = Harmonograph.make_from_short_params(slug_params)
     params = list(harm.parameters())
     shorts = harm.short_parameters()
+    # Browsers list the image formats they take in the page's Accept too.
+    fmt = negotiate(request.accept_mimetypes)
+    page = prerenderer.new_page()
     param_display = []
     for paramdef, thing, extra_name, val in params:
         if extra_name is not None and extra_name not in harm.render.extras:
@@ -141,15 +335,13 @@ def one(slug):
             adj_params.update(one_param)
             adj_harm = Harmonograph.make_from_short_params(adj_params)
             adj_repr = paramdef.type.repr(adj)
-            adj_thumbs.append(
-                (
-                    adj_repr,
-                    dict_to_slug(one_param),
-                    Thumb(adj_harm, size=(THUMBX, THUMBY)),
-                )
-            )
+            adj_thumb = Thumb(adj_harm, size=(THUMBX, THUMBY))
+            adj_thumb.prerender(fmt, page)
+            adj_thumbs.append((adj_repr, dict_to_slug(one_param), adj_thumb))
         param_display.append((name, adj_thumbs))
 
+    # The thumbnails are prerendering in a lower lane while this draws.
+    svg = executor.run("page", render_svg, slug_params, (FULLX // 2, FULLY // 2))
     return render_template(
         "one.html",
         svg=svg,
@@ -164,8 +356,31 @@ def png(slug):
     params = slug_to_dict(slug)
     harm = Harmonograph.make_from_short_params(params)
     sx, sy = int(params.get("sx", FULLX)), int(params.get("sy", FULLY))
-    png_bytes = draw_png(curve=harm, size=(sx, sy))
-    return send_file(png_bytes, mimetype="image/png")
+    level = PNG_LEVELS["png"]
+    fmt = negotiate(request.accept_mimetypes)
+
+    key = curve_key(harm, "png", (sx, sy), level=level, fmt=fmt)
+    lod_level = None
+    if key not in render_cache and uses_lod(harm, (sx, sy)):
+        # Only derive from a level that's already drawn, like the master of a
+        # download: drawing a master costs as much as many thumbnails.
+        pyramid = lod_pyramid(harm, params, "thumb")
+        lod_level = pyramid.cached_level((sx, sy))
+
+    if lod_level is not None:
+        key = curve_key(harm, "png", (sx, sy), level=level, fmt=fmt, lod=True)
+
+        def render():
+            return pyramid.image((sx, sy), fmt, level, from_size=lod_level)
+
+    else:
+
+        def render():
+            return executor.run("thumb", render_image, params, (sx, sy), fmt, level)
+
+    resp = cached_image(key, render, mimetype=MIMETYPES[fmt])
+    resp.vary.add("Accept")
+    return resp
 
 
 @app.route("/download/<slug>")
@@ -173,14 +388,99 @@ def download(slug):
     params = slug_to_dict(slug)
     harm = Harmonograph.make_from_short_params(params)
     sx, sy = int(params.get("sx", FULLX)), int(params.get("sy", FULLY))
-    png_bytes = draw_png(curve=harm, size=(sx, sy), with_metadata=True)
     hash = hashlib.md5(slug.encode("ascii")).hexdigest()[:10]
     filename = f"flourish_{hash}.png"
-    return send_file(
-        png_bytes, as_attachment=True, download_name=filename, mimetype="image/png"
+    level = PNG_LEVELS["download"]
+
+    def render():
+        if uses_lod(harm, (sx, sy)) and (sx, sy) == LOD_MASTER:
+            # The same pixels as drawing it, but perhaps already drawn.
+            pyramid = lod_pyramid(harm, params, "download")
+            data = pyramid.image(LOD_MASTER, level=level, text=png_metadata(harm))
+        else:
+            data = executor.run(
+                "download", render_image, params, (sx, sy), "png", level, True
+            )
+        return [data]
+
+    return streamed_image(
+        curve_key(harm, "download", (sx, sy), level=level),
+        render,
+        mimetype="image/png",
+        download_name=filename,
     )
 
 
+@app.route("/sprite/<sheet_id>")
+def sprite(sheet_id):
+    slugs = random_sheet_slugs(sheet_id)
+    if slugs is None:
+        abort(404)
+
+    def render():
+        return executor.run("page", render_sprite, slugs, SPRITE_COLUMNS)
+
+    return cached_image(cache_key("sprite", sheet_id), render, mimetype="image/png")
+
+
+def cached_image(key, render, **send_kwargs):
+    """
+    Respond with the image cached under `key`, rendering it if needed.
+
+    The key is a hash of everything the image depends on, so it makes a
+    strong ETag, and the image can be cached forever.
+    """
+    if request.if_none_match.contains(key):
+        resp = make_response("", 304)
+    else:
+        data = render_cache.get_or_render(key, render, flights)
+        resp = send_file(BytesIO(data), etag=False, **send_kwargs)
+    return immutable(resp, key)
+
+
+def streamed_image(key, render, mimetype, download_name=None):
+    """
+    Respond with the image cached under `key`, or stream it while rendering.
+
+    `render()` returns an iterator of the image's bytes.  They are sent as
+    they are produced, and cached once they all have been.  If
+    `download_name` is given, the image is sent as an attachment.
+    """
+    if request.if_none_match.contains(key):
+        resp = make_response("", 304)
+    else:
+        data = render_cache.get(key)
+        if data is not None:
+            body = data
+        else:
+            body = render_cache.tee(key, render())
+        resp = app.response_class(body, mimetype=mimetype)
+        if download_name is not None:
+            resp.headers.set(
+                "Content-Disposition", "attachment", filename=download_name
+            )
+    return immutable(resp, key)
+
+
+@app.errorhandler(Busy)
+def busy(exc):
+    """
+    Ask the client to come back when there's room to render.
+    """
+    resp = make_response("Too busy to draw this right now.\n", 503)
+    resp.headers["Retry-After"] = str(exc.retry_after)
+    return resp
+
+
+def immutable(resp, key):
+    """
+    Mark `resp` as the never-changing content for the hash `key`.
+    """
+    resp.set_etag(key)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     uploaded_file = request.files["file"]
@@ -189,8 +489,7 @@ def upload_file():
             pngio = BytesIO()
             uploaded_file.save(pngio)
             pngio.seek(0)
-            im = Image.open(pngio)
-            params = im.info.get(PNG_STATE_KEY)
+            params = read_text(pngio).get(PNG_STATE_KEY)
             if params:
                 slug = dict_to_slug(json.loads(params))
                 return redirect(f"/one/{slug}")
@@ -207,6 +506,18 @@ def one_url(route, harm, **kwargs):
     return f"{route}/{slug}"
 
 
+@app.route("/stats")
+def stats():
+    return {
+        "render_cache": render_cache.stats(),
+        "prerender": prerenderer.stats(),
+        "executor": executor.stats(),
+        "single_flight": flights.stats(),
+        "random_pool": random_pool.stats(),
+        "simplify": simplify_stats.stats(),
+    }
+
+
 @app.route("/robots.txt")
 def robots_txt():
     return textwrap.dedent(